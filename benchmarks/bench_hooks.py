@@ -0,0 +1,173 @@
+# Measures what the plugin costs OctoPrint: replays synthetic gcode streams and
+# temperature logs through the hooks and reports throughput and p50/p99
+# latency per call, plus the frame rate of the strip on mock pins.
+#
+#   python benchmarks/bench_hooks.py --output results.json
+#   python benchmarks/bench_hooks.py --compare results.json
+#
+# Results are written as JSON so runs can be compared for regressions.
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import stubs
+
+from octoprint_P9813LedControl.backends import create_backend
+from octoprint_P9813LedControl.ledstrip import LEDStrip
+
+GCODE_LINES = 200000
+TEMPERATURE_REPORTS = 20000
+PROGRESS_TICKS = 20000
+EFFECT_CALLS = 20000
+FRAMES = 200
+
+
+def gcode_stream(count, seed=0):
+    # Mostly moves, with the occasional heatup and M150 sprinkled in
+    rng = random.Random(seed)
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.0005:
+            yield 'M109 S210', 'M109'
+        elif roll < 0.001:
+            yield 'M190 S60', 'M190'
+        elif roll < 0.002:
+            yield 'M150 R{} U{} B{}'.format(rng.randrange(256), rng.randrange(256), rng.randrange(256)), 'M150'
+        elif roll < 0.05:
+            yield 'G0 X{:.3f} Y{:.3f}'.format(rng.uniform(0, 200), rng.uniform(0, 200)), 'G0'
+        else:
+            yield 'G1 X{:.3f} Y{:.3f} E{:.5f}'.format(rng.uniform(0, 200), rng.uniform(0, 200), rng.uniform(0, 1)), 'G1'
+
+
+def temperature_log(count):
+    # Tool and bed heating up from room temperature, then holding
+    for i in range(count):
+        progress = min(1.0, i / (count * 0.8))
+        yield {
+            'T0': (20 + 190 * progress, 210.0),
+            'B': (20 + 40 * progress, 60.0)
+        }
+
+
+def measure(name, calls):
+    latencies = []
+    perf_counter = time.perf_counter
+    started = perf_counter()
+    for call in calls:
+        before = perf_counter()
+        call()
+        latencies.append(perf_counter() - before)
+    elapsed = perf_counter() - started
+
+    latencies.sort()
+    return name, dict(
+        calls=len(latencies),
+        per_second=len(latencies) / elapsed if elapsed else 0,
+        p50_us=latencies[len(latencies) // 2] * 1e6,
+        p99_us=latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6
+    )
+
+
+def bench_gcode(plugin, intercept_m150):
+    plugin._settings.set(['intercept_m150'], intercept_m150)
+    plugin.load_config()
+    hook = plugin.process_gcode_q
+    lines = list(gcode_stream(GCODE_LINES))
+    return measure('process_gcode_q' + ('_m150' if intercept_m150 else ''), (
+        lambda cmd=cmd, gcode=gcode: hook(None, 'queuing', cmd, None, gcode) for cmd, gcode in lines))
+
+
+def bench_temperatures(plugin):
+    plugin.process_gcode_q(None, 'queuing', 'M109 S210', None, 'M109')
+    hook = plugin.temperatures_received
+    reports = list(temperature_log(TEMPERATURE_REPORTS))
+    return measure('temperatures_received', (
+        lambda report=report: hook(None, report) for report in reports))
+
+
+def bench_progress(plugin):
+    plugin.process_gcode_q(None, 'queuing', 'G1 X10', None, 'G1')  # Ends the heat-up
+    hook = plugin.on_print_progress
+    return measure('on_print_progress', (
+        lambda progress=i % 100: hook('local', 'benchmark.gcode', progress) for i in range(PROGRESS_TICKS)))
+
+
+def bench_update_effect(plugin):
+    modes = ['idle', 'paused', 'failed', 'success', 'on', 'off']
+    update_effect = plugin.update_effect
+    return measure('update_effect', (
+        lambda mode=modes[i % len(modes)]: update_effect(mode) for i in range(EFFECT_CALLS)))
+
+
+def bench_frames(backend):
+    # Driven from this thread without the output worker, every frame differs so none are skipped
+    strip = LEDStrip(create_backend(backend, 13, 12))
+    name, result = measure('strip_frame', (
+        lambda i=i: strip.setcolourrgb(i % 256, 255 - i % 256, 0) for i in range(FRAMES)))
+    result['frames_per_second'] = result.pop('per_second')
+    return name, result
+
+
+def run(overrides):
+    plugin = stubs.create_plugin(overrides)
+    try:
+        results = dict([
+            bench_gcode(plugin, False),
+            bench_gcode(plugin, True),
+            bench_temperatures(plugin),
+            bench_progress(plugin),
+            bench_update_effect(plugin),
+        ])
+    finally:
+        plugin.on_shutdown()
+
+    results.update([bench_frames(overrides['led_backend'])])
+
+    return dict(
+        timestamp=time.time(),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        settings=overrides,
+        results=results
+    )
+
+
+def compare(current, baseline):
+    print("{:<26} {:>14} {:>14} {:>8}".format('benchmark', 'p50 us', 'baseline', 'change'))
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        change = (result['p50_us'] / before['p50_us'] - 1) * 100 if before['p50_us'] else 0
+        print("{:<26} {:>14.2f} {:>14.2f} {:>+7.1f}%".format(name, result['p50_us'], before['p50_us'], change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the P9813 LED Control hooks")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--backend', default='bitbang', help="output backend to use")
+    args = parser.parse_args(argv)
+
+    report = run(dict(led_backend=args.backend))
+
+    for name, result in sorted(report['results'].items()):
+        rate = result.get('per_second', result.get('frames_per_second'))
+        print("{:<26} {:>12.0f}/s  p50 {:>9.2f} us  p99 {:>9.2f} us".format(
+            name, rate, result['p50_us'], result['p99_us']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+# Measures how long the PixelRenderer and FrameEncoder take to produce a
+# progress bar frame for chains of 1, 10 and 100 modules.
+#
+#   python benchmarks/bench_renderer.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from octoprint_P9813LedControl import renderer  # noqa: E402
+from octoprint_P9813LedControl.encoder import FrameEncoder  # noqa: E402
+
+PIXEL_COUNTS = [1, 10, 100]
+FRAMES = 2000
+
+
+def bench(pixel_count):
+    render = renderer.PixelRenderer(pixel_count, brightness=80, gamma=2.2)
+    encoder = FrameEncoder()
+    progress = iter(range(10 ** 9))
+
+    def frame():
+        # Keep changing the progress so neither the renderer nor the frame cache is warm
+        encoder.encode(render.progress((0, 0, 0), (0, 255, 0), next(progress) % 1000 / 10.0))
+
+    return min(timeit.repeat(frame, number=FRAMES, repeat=3)) / FRAMES
+
+
+def main():
+    print("NumPy: {}".format('yes' if renderer.load_numpy() is not None else 'no, pure Python fallback'))
+    for pixel_count in PIXEL_COUNTS:
+        print("{:>4} pixels: {:8.1f} us/frame".format(pixel_count, bench(pixel_count) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Replays a frame trace (the plugin's frames.trace, enable "Keep the trace in
+# a file" in the settings) through a simulated strip on mock pins. Prints the
+# colours and mode of every frame, flags colour words the encoder could not
+# have produced, and reports how far the replay fell behind the recorded
+# timing.
+#
+#   python benchmarks/replay_trace.py frames.trace
+#   python benchmarks/replay_trace.py frames.trace --backend spi --speed 0
+#
+# --speed scales the recorded timing, 0 replays the frames back to back.
+
+import argparse
+import functools
+import sys
+import time
+
+import stubs
+
+from octoprint_P9813LedControl.backends import BACKEND_SPI, FakeSpiDev, SPIBackend, create_backend
+from octoprint_P9813LedControl.encoder import decodeframe
+from octoprint_P9813LedControl.ledstrip import LEDStrip
+from octoprint_P9813LedControl.trace import load_trace
+
+
+def simulated_backend(name):
+    if name == BACKEND_SPI:
+        return SPIBackend(spi_factory=functools.partial(FakeSpiDev, record=True))
+    return create_backend(name, 13, 12)
+
+
+def describe(frame):
+    colours = []
+    invalid = 0
+    for red, green, blue, valid in decodeframe(frame):
+        colours.append('#{:02x}{:02x}{:02x}{}'.format(red, green, blue, '' if valid else '!'))
+        invalid += not valid
+    return ' '.join(colours), invalid
+
+
+def replay(records, backend, speed=1.0, quiet=False):
+    strip = LEDStrip(backend)
+    first = records[0][0]
+    started = time.monotonic()
+    late = []
+    invalid = 0
+
+    for timestamp, mode, frame in records:
+        offset = timestamp - first
+        if speed > 0:
+            delay = started + offset / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            late.append(max(0.0, time.monotonic() - started - offset / speed))
+
+        strip.mode = mode
+        strip.write(frame, force=True)
+
+        colours, bad = describe(frame)
+        invalid += bad
+        if not quiet:
+            print("{:10.3f} {:<16} {}".format(offset, mode, colours))
+
+    backend.close()
+    return dict(frames=len(records), invalid_words=invalid, duration=records[-1][0] - first,
+                max_late=max(late) if late else 0.0, frames_sent=strip.frames_sent)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a P9813 LED Control frame trace")
+    parser.add_argument('trace', help="trace file to replay")
+    parser.add_argument('--backend', default='bitbang', help="simulated output backend to replay through")
+    parser.add_argument('--speed', type=float, default=1.0, help="timing scale, 0 replays as fast as possible")
+    parser.add_argument('--quiet', action='store_true', help="only print the summary")
+    args = parser.parse_args(argv)
+
+    records = load_trace(args.trace)
+    if not records:
+        print("The trace is empty")
+        return 1
+
+    stubs.use_mock_pins()
+    backend = simulated_backend(args.backend)
+    result = replay(records, backend, args.speed, args.quiet)
+
+    if args.backend == BACKEND_SPI:
+        # The simulated bus has to have seen exactly the recorded frames
+        sent = [bytes(transfer) for transfer in backend.device.transfers]
+        result['bus_mismatches'] = sum(a != b for a, b in zip(sent, (frame for _, _, frame in records)))
+
+    print("{frames} frames over {duration:.3f} s, {invalid_words} invalid colour words, "
+          "replay at most {late:.1f} ms late".format(late=result.pop('max_late') * 1e3, **result))
+    if 'bus_mismatches' in result:
+        print("{} frames differed on the simulated bus".format(result['bus_mismatches']))
+
+    return 1 if result['invalid_words'] or result.get('bus_mismatches') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# Minimal stand-ins for the objects OctoPrint injects into the plugin, so it can
+# be driven outside of a running server. The LED pins come from gpiozero's
+# MockFactory.
+
+import logging
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gpiozero import Device  # noqa: E402
+from gpiozero.pins.mock import MockFactory  # noqa: E402
+
+import octoprint_P9813LedControl  # noqa: E402
+
+
+class StubSettings:
+
+    def __init__(self, defaults, overrides=None):
+        self.__values = dict(defaults)
+        self.__values.update(overrides or {})
+
+    def get(self, path, **kwargs):
+        return self.__values.get(path[0])
+
+    def get_boolean(self, path, **kwargs):
+        return bool(self.__values.get(path[0]))
+
+    def get_int(self, path, **kwargs):
+        value = self.__values.get(path[0])
+        return None if value is None else int(value)
+
+    def get_float(self, path, **kwargs):
+        value = self.__values.get(path[0])
+        return None if value is None else float(value)
+
+    def set(self, path, value, **kwargs):
+        self.__values[path[0]] = value
+
+
+class StubPluginManager:
+
+    def __init__(self):
+        self.messages = []
+
+    def send_plugin_message(self, identifier, data):
+        self.messages.append(data)
+
+
+def use_mock_pins():
+    if not isinstance(Device.pin_factory, MockFactory):
+        Device.pin_factory = MockFactory()
+
+
+def create_plugin(overrides=None, start=True, mock_pins=True):
+    # mock_pins makes gpiozero's default pin factory a MockFactory, leave it off when passing pins of your own
+    if mock_pins:
+        use_mock_pins()
+
+    plugin = octoprint_P9813LedControl.P9813LedControlPlugin()
+    plugin._identifier = 'P9813LedControl'
+    plugin._plugin_version = 'benchmark'
+    plugin._settings = StubSettings(plugin.get_settings_defaults(), overrides)
+    plugin._plugin_manager = StubPluginManager()
+    plugin._data_folder = tempfile.mkdtemp(prefix='P9813LedControl-')
+    plugin._logger = logging.getLogger('octoprint.plugins.P9813LedControl')
+    plugin._logger.addHandler(logging.NullHandler())
+    plugin._logger.propagate = False
+
+    if start:
+        plugin.on_after_startup()
+    return plugin
@@ -1,18 +1,39 @@
 # coding=utf-8
 from __future__ import absolute_import
-import octoprint.plugin
-
-from flask import jsonify
-
-import time
+import functools
+import os
 import threading
+import time
 
-from octoprint_P9813LedControl.ledstrip import LEDStrip
-
-BLOCKING_TEMP_GCODES = ["M109", "M190"]
+import octoprint.plugin
+from octoprint.filemanager import FileDestinations
+
+from flask import jsonify, make_response
+
+from octoprint_P9813LedControl.ledstrip import LEDStrip, LEDWorker
+from octoprint_P9813LedControl.renderer import PixelRenderer, load_numpy
+from octoprint_P9813LedControl.effects import AnimationEngine
+from octoprint_P9813LedControl.config import PluginConfig, HOOK_GCODES, KIND_ON, KIND_OFF, KIND_EFFECT, KIND_TORCH, \
+    KIND_PROGRESS
+from octoprint_P9813LedControl.scheduler import Scheduler
+from octoprint_P9813LedControl.m150 import parse_m150
+from octoprint_P9813LedControl.heatup import HeatupTracker
+from octoprint_P9813LedControl.backends import create_backend
+from octoprint_P9813LedControl.trace import FrameTrace, trace_frame_size
+from octoprint_P9813LedControl.metrics import Metrics
+from octoprint_P9813LedControl.frames import FrameRequestError, parse_frame_request
+from octoprint_P9813LedControl.state import Command, PluginState
+from octoprint_P9813LedControl.layers import PHASE_MODES, ScheduleCache, analyse_file, file_key
+
+BLOCKING_TEMP_GCODES = frozenset(["M109", "M190"])
 ON_AT_COMMAND = 'WS_LIGHTSON'
 OFF_AT_COMMAND = 'WS_LIGHTSOFF'
 AT_COMMANDS = [ON_AT_COMMAND, OFF_AT_COMMAND]
+STATUS_DEBOUNCE = 0.25  # Seconds to collect state changes before pushing them to the UI
+COMMAND_TIMEOUT = 10  # Seconds to wait for a command whose caller needs the result, e.g. an API request
+TRACE_FILE = 'frames.trace'
+WHITE = (255, 255, 255)
+OFF = (0, 0, 0)
 
 
 class P9813LedControlPlugin(
@@ -26,23 +47,54 @@ class P9813LedControlPlugin(
         octoprint.plugin.EventHandlerPlugin,
         octoprint.plugin.RestartNeedingPlugin):
 
+    # Everything below is only written on the scheduler thread, see submit, apart
+    # from the heat-up tracking of the hooks. Other threads read the state snapshot
+    # instead.
+    state = PluginState()  # Immutable snapshot of the state for readers on other threads
+
     lights_on = False  # Lights are off by default
     torch_on = False  # Torch is off by default, because who would want that?
 
-    torch_timer = None  # Timer for torch function
-    return_timer = None  # Timer object when we want to return to idle.
-    auto_off_timer = None  # Timer object for turning the lights off
+    scheduler = None  # Runs every delayed transition below, and the animation frames
+    torch_timer = None  # Scheduled call for torch function
+    mode_timer = None  # Scheduled switch to the next mode, e.g. success to idle or idle to off
+    m150_timer = None  # Scheduled output of the colours set by M150
+    m150_pixels = None  # Pixel buffer M150 commands are applied to
+    frame_timer = None  # Scheduled next frame of a sequence set through the API
+    frame_sequence = None  # Frames of the sequence playing, None once another effect took over
+    frame_pixels = None  # Last frame shown from the API
 
     # Idle, startup, progress etc. Used to put the old effect back on settings change/light switch
     current_state = 'off'
+    current_value = None  # Value of the current state, e.g. the print progress
+    current_effect = 'off'  # Last effect requested through update_effect, shown in the UI
+
+    status_timer = None  # Scheduled push of the status to the UI
+    sent_status = None  # Last status pushed to the UI
 
-    # True when heating is detected, options below are helpers for tracking heatup.
+    # True while the hooks see a heat-up, set by set_heating
+    heatup_active = False
+
+    # Owned by OctoPrint's comm thread running the gcode and temperature hooks, never written elsewhere:
+    # True when heating is detected, the tracker follows the progress of all active heaters.
     heating = False
-    temp_target = 0
-    current_heater_heating = None
-    tool_to_target = 0  # Overridden by the plugin settings
+    heatup = HeatupTracker()
+    heatup_config = None  # PluginConfig the tracker was built from
+
+    config = PluginConfig()  # Settings snapshot for the hooks, rebuilt on startup and settings save
+    effects = {}  # Mode name to (handler, ModeConfig), compiled with the config
+
+    selected_file = None  # (origin, path) of the selected file
+    layer_schedule = None  # LayerSchedule of the selected file, None until analysed
+    schedules = None  # ScheduleCache of analysed files
+    analysing = None  # Keys of the files being analysed
 
-    led = None
+    led = None  # LEDWorker owning the strip, colours posted to it are sent asynchronously
+    strip_settings = None  # Hardware settings the strip was opened with
+    trace = None  # FrameTrace of the frames sent to the strip
+    metrics = Metrics()  # Timings and counters of the hot paths, see get_metrics
+    renderer = None  # PixelRenderer turning effects into pixel buffers for the strip
+    animation = None  # AnimationEngine playing the current mode's effect
 
     supported_events = {
         'Connected': 'idle',
@@ -53,18 +105,62 @@ class P9813LedControlPlugin(
     }
 
     def on_after_startup(self):
-        self.restart_strip()
+        self.load_config()
+        self.schedules = ScheduleCache(os.path.join(self.get_plugin_data_folder(), 'layers'))
+        self.analysing = set()
+
+        self.scheduler = Scheduler(logger=self._logger)
+        self.scheduler.start()
+
+        self.submit(self.restart_strip, wait=True)
         self.update_effect("off")
 
-    def return_to_idle(self):
-        self.update_effect('idle')
+    def submit(self, action, *args, wait=False):
+        # Queues a command for the scheduler thread, the single writer of the
+        # plugin's state. Commands from the scheduler thread itself, or while
+        # it isn't running, run right away.
+        command = Command(action, args, wait)
+        scheduler = self.scheduler
+        if scheduler is None or threading.current_thread() is scheduler or not scheduler.is_alive():
+            self.execute(command)
+            return
+
+        scheduler.call_soon(self.execute, command)
+        if not command.wait(COMMAND_TIMEOUT):
+            self._logger.warning("Timed out waiting for {}".format(action.__name__))
+
+    def execute(self, command):
+        try:
+            command.run()
+        finally:
+            self.publish_state()
 
-    def return_to_off(self):
-        self.update_effect('off')
+    def publish_state(self):
+        self.state = PluginState(self.lights_on, self.torch_on, self.current_effect)
+
+    def load_config(self):
+        self.config = PluginConfig.from_settings(self._settings, self._logger)
+
+        handlers = {
+            KIND_ON: self.setOn,
+            KIND_OFF: self.setOff,
+            KIND_EFFECT: self.setModeColor,
+            KIND_TORCH: self.setTorch,
+            KIND_PROGRESS: self.setModeProgress
+        }
+        self.effects = dict((name, (handlers[mode.kind], mode)) for name, mode in self.config.modes.items())
 
     def on_event(self, event, payload):
+        if self.scheduler is None:
+            return  # Not started yet, on_after_startup sets the lights
+
         if self.led == None:
-            self.restart_strip()
+            self.submit(self.restart_strip)
+
+        if event == 'FileSelected':
+            self.submit(self.select_file, payload.get('origin'), payload.get('path'))
+        elif event == 'FileDeselected':
+            self.submit(self.select_file, None, None)
 
         try:
             self.update_effect(self.supported_events[event])
@@ -73,31 +169,126 @@ class P9813LedControlPlugin(
 
     # Shutdown plugin
     def on_shutdown(self):
-        self.update_effect('off')
+        self.submit(self.set_effect, 'off', wait=True)
+        self.submit(self.stop_strip, wait=True)
+        self.close_trace()
+
+        if self.scheduler is not None:
+            self.scheduler.stop()
 
     def on_print_progress(self, storage, path, progress):
-        if progress == 100 or self.current_state == 'success' or self.heating:
+        if progress == 100:
+            return
+
+        self.submit(self.apply_print_progress, progress)
+
+    def apply_print_progress(self, progress):
+        if self.current_state == 'success' or self.heatup_active:
             return
 
-        if self._settings.get_boolean(['printing_enabled']):
+        if self.current_effect == 'M150':
+            # Colours set by the gcode, e.g. per layer by the slicer, stay on until the next print event
+            return
+
+        if self.layer_schedule is not None:
+            mode = PHASE_MODES.get(self.layer_schedule.phase_at(progress))
+            if mode is not None and self.config.modes[mode].enabled:
+                self.update_effect(mode)
+                self.current_state, self.current_value = mode, None  # Put back once the torch expires
+                return
+
+        if self.config.modes['printing'].enabled:
             self.update_effect('printing')
+            self.current_state, self.current_value = 'printing', None
             return
 
         self.update_effect('progress_print', progress)
 
+    def select_file(self, origin, path):
+        self.selected_file = (origin, path)
+        self.layer_schedule = None
+
+        if path is None or not self._settings.get_boolean(['layer_schedule_enabled']):
+            return
+        if origin != FileDestinations.LOCAL:
+            return  # Files on the printer's SD card can't be read
+
+        try:
+            disk_path = self._file_manager.path_on_disk(origin, path)
+            metadata = self._file_manager.get_metadata(origin, path) or {}
+            final_layers = self._settings.get_int(['layer_final_count'])
+            infill_threshold = self._settings.get_int(['layer_infill_threshold']) / 100.0
+            key = file_key(disk_path, metadata.get('hash'), final_layers, infill_threshold)
+        except Exception:
+            self._logger.exception("Could not analyse the layers of {}".format(path))
+            return
+
+        if key in self.analysing:
+            return  # Reselected while being analysed, the running analysis sets the schedule
+        self.analysing.add(key)
+
+        # Long files take a while to read, the analysis runs on its own thread
+        thread = threading.Thread(
+            target=self.analyse_layers, args=(origin, path, disk_path, key, final_layers, infill_threshold),
+            name="P9813LedControl layer analysis")
+        thread.daemon = True
+        thread.start()
+
+    def analyse_layers(self, origin, path, disk_path, key, final_layers, infill_threshold):
+        started = time.perf_counter()
+        schedule = None
+        try:
+            schedule = self.schedules.get(key)
+            if schedule is None:
+                schedule = analyse_file(disk_path, final_layers, infill_threshold)
+                self.schedules.put(key, schedule)
+                self._logger.info("Analysed {} layers of {} in {:.0f} ms".format(
+                    schedule.layers, path, (time.perf_counter() - started) * 1e3))
+        except Exception:
+            self._logger.exception("Could not analyse the layers of {}".format(path))
+        finally:
+            self.submit(self.set_layer_schedule, origin, path, key, schedule)
+
+    def set_layer_schedule(self, origin, path, key, schedule):
+        self.analysing.discard(key)
+        if schedule is not None and (origin, path) == self.selected_file:
+            self.layer_schedule = schedule
+
     def get_api_commands(self):
         # Simple API plugin
         return dict(
             toggle_lights=[],
             activate_torch=[],
-            get_status=[]
+            get_status=[],
+            get_metrics=[],
+            reset_metrics=[],
+            set_frame=[]
         )
 
     def on_api_get(self, request=None):
-        return jsonify(
-            lights_status=self.get_lights_status(),
-            torch_status=self.get_torch_status()
-        )
+        return jsonify(**self.get_status())
+
+    def get_status(self):
+        # Lock-free, the snapshot is replaced as a whole by the writer
+        return self.state.status()
+
+    def publish_status(self):
+        # Debounced, a burst of changes results in a single message with the final state
+        if self.status_timer is not None or self.scheduler is None:
+            return
+
+        if self.get_status() != self.sent_status:
+            self.status_timer = self.scheduler.call_later(STATUS_DEBOUNCE, self.send_status)
+
+    def send_status(self):
+        self.status_timer = None
+
+        status = self.get_status()
+        if status == self.sent_status:
+            return
+
+        self.sent_status = status
+        self._plugin_manager.send_plugin_message(self._identifier, status)
 
     def on_api_command(self, command, data):
         if command == 'toggle_lights':
@@ -108,9 +299,28 @@ class P9813LedControlPlugin(
             return self.on_api_get()
         elif command == 'get_status':
             return self.on_api_get()
+        elif command == 'get_metrics':
+            return jsonify(**self.get_metrics())
+        elif command == 'reset_metrics':
+            self.submit(self.reset_metrics, wait=True)
+            return jsonify(**self.get_metrics())
+        elif command == 'set_frame':
+            renderer = self.renderer
+            if renderer is None:
+                return make_response(jsonify(error="The LED strip is not started"), 409)
+
+            try:
+                frames = parse_frame_request(data, renderer.pixel_count)
+            except FrameRequestError as error:
+                return make_response(jsonify(error=str(error)), 400)
+
+            self.submit(self.set_effect, 'frame', frames, wait=True)
+            return self.on_api_get()
 
     def toggle_lights(self):
-        # Switch from False -> True or True -> False
+        self.submit(self.apply_toggle_lights, wait=True)
+
+    def apply_toggle_lights(self):
         # Switch from False -> True or True -> False
         self.lights_on = False if self.lights_on else True
         self.update_effect('on' if self.lights_on else 'off')
@@ -118,15 +328,16 @@ class P9813LedControlPlugin(
             'on' if self.lights_on else 'off'))
 
     def activate_torch(self):
-        if self.torch_timer and self.torch_timer.is_alive():
+        self.submit(self.apply_torch, wait=True)
+
+    def apply_torch(self):
+        if self.torch_timer is not None:
             self.torch_timer.cancel()
 
         self._logger.debug("Starting timer for {} secs, to deativate torch".format(
             self._settings.get_int(['torch_timer'])))
-        self.torch_timer = threading.Timer(
+        self.torch_timer = self.scheduler.call_later(
             int(self._settings.get_int(['torch_timer'])), self.deactivate_torch)
-        self.torch_timer.daemon = True
-        self.torch_timer.start()
         self.torch_on = True
         self.update_effect('torch')
 
@@ -135,180 +346,435 @@ class P9813LedControlPlugin(
             "Deactivating torch mode, torch on currently: {}".format(self.torch_on))
         if self.torch_on:
             self.torch_on = False
-            self.update_effect(self.current_state)
+            self.update_effect(self.current_state, self.current_value)
 
-    def update_effect(self, mode_name, value=None, m150=None):
-        if self.return_timer is not None and self.return_timer.is_alive():
-            self.return_timer.cancel()
+    def get_metrics(self):
+        metrics = self.metrics.snapshot()
+        counters = metrics['counters']
 
-        if self.auto_off_timer is not None and self.auto_off_timer.is_alive():
-            self.auto_off_timer.cancel()
+        if self.led is not None:
+            counters.update(
+                frames_sent=self.led.strip.frames_sent,
+                frames_skipped=self.led.strip.frames_skipped,
+                frames_rendered=self.animation.frames_rendered,
+                frames_dropped=self.animation.frames_dropped)
+
+        if self.scheduler is not None:
+            counters.update(
+                timers_scheduled=self.scheduler.calls_scheduled,
+                timers_run=self.scheduler.calls_run,
+                timers_cancelled=self.scheduler.calls_cancelled,
+                timers_pending=self.scheduler.pending())
+        return metrics
+
+    def reset_metrics(self):
+        self.metrics.reset()
 
-        if mode_name in ['on']:
-            self.led.setcolourwhite()
-            self.lights_on = True
-            self._logger.debug("Turning lights on")
-            return
+        if self.led is not None:
+            self.led.strip.frames_sent = self.led.strip.frames_skipped = 0
+            self.animation.frames_rendered = self.animation.frames_dropped = 0
 
-        if mode_name in ['off', 'disconnected']:
-            self.led.setcolouroff()
-            self.lights_on = False
-            self._logger.debug("Turning lights off")
-            return
+        if self.scheduler is not None:
+            self.scheduler.calls_scheduled = self.scheduler.calls_run = self.scheduler.calls_cancelled = 0
 
-        if 'torch' in mode_name:
-            if self.torch_on:
-                self.led.setcolourwhite()
-            else:
-                self.led.setcolouroff()
-            return
+    def update_effect(self, mode_name, value=None, m150=None):
+        self.submit(self.set_effect, mode_name, value, m150)
 
-        if 'idle' in mode_name and self._settings.get_boolean(['idle_enabled']):
-            self.setModeColor(mode_name)
+    def set_effect(self, mode_name, value=None, m150=None):
+        self.metrics.effects += 1
+        self.current_effect = mode_name  # Set first, the frames posted are tagged with it
+        self.apply_effect(mode_name, value, m150)
 
-            auto_off_time = self._settings.get_int(
-                ['auto_off_time'])
-            if auto_off_time > 0:
-                self.auto_off_timer = threading.Timer(
-                    auto_off_time, self.return_to_off)
-                self.auto_off_timer.daemon = True
-                self.auto_off_timer.start()
-            return
+        self.publish_state()
+        self.publish_status()
 
-        if 'paused' in mode_name and self._settings.get_boolean(['paused_enabled']):
-            self.setModeColor(mode_name)
-            return
+    def apply_effect(self, mode_name, value=None, m150=None):
+        if self.mode_timer is not None:
+            self.mode_timer.cancel()
+            self.mode_timer = None
 
-        if 'failed' in mode_name and self._settings.get_boolean(['failed_enabled']):
-            self.setModeColor(mode_name)
+        if self.frame_timer is not None:
+            self.frame_timer.cancel()
+            self.frame_timer = None
+        self.frame_sequence = None
+
+        if mode_name == 'M150':
+            self.setM150(m150)
             return
 
-        if 'success' in mode_name and self._settings.get_boolean(['success_enabled']):
-            self.setModeColor(mode_name)
+        if self.m150_timer is not None:
+            self.m150_timer.cancel()
+            self.m150_timer = None
 
-            return_idle_time = self._settings.get_int(['success_return_idle'])
-            if return_idle_time > 0:
-                self.return_timer = threading.Timer(
-                    return_idle_time, self.return_to_idle)
-                self.return_timer.daemon = True
-                self.return_timer.start()
+        if mode_name == 'frame':
+            self.setFrames(*value)
             return
 
-        if 'progress_heatup' in mode_name and self._settings.get_boolean(['progress_heatup_enabled']):
-            self.setModeColor(mode_name)
+        try:
+            handler, mode = self.effects[mode_name]
+        except KeyError:
+            self._logger.warning("Unknown effect {}, ignoring".format(mode_name))
             return
 
-        if 'progress' in mode_name:
-            if not value:
-                self._logger.warning(
-                    "No value supplied with progress style effect, ignoring")
-                return
+        if not mode.enabled:
+            return
 
-            self.setModeColor(mode_name)
-            self.current_state = '{} {}'.format(mode_name, value)
+        handler(mode, value)
+
+        if mode.timeout > 0:
+            self.mode_timer = self.scheduler.call_later(mode.timeout, self.update_effect, mode.then)
 
     def get_lights_status(self):
-        return (self.lights_on or self.torch_on)
+        return self.state.lights_on or self.state.torch_on
 
     def get_torch_status(self):
-        return self.torch_on
+        return self.state.torch_on
+
+    def showColor(self, rgb):
+        self.led.post(self.renderer.fill(rgb), self.current_effect)
+
+    def setColor(self, rgb):
+        self.animation.clear()
+        self.showColor(rgb)
+
+    def setOn(self, mode, value=None):
+        self.setColor(WHITE)
+        self.lights_on = True
+        self._logger.debug("Turning lights on")
+
+    def setOff(self, mode, value=None):
+        self.setColor(OFF)
+        self.lights_on = False
+        self._logger.debug("Turning lights off")
+
+    def setTorch(self, mode, value=None):
+        if self.torch_on:
+            self.setModeColor(mode)
+        else:
+            self.setColor(OFF)
 
-    def setModeColor(self, mode):
-        color = self._settings.get(['{}_color'.format(mode)]).strip('#')
+    def setModeColor(self, mode, value=None):
         self._logger.debug(
-            "Setting {} color to #{}".format(mode, color))
+            "Setting {} color to {} with {} effect".format(mode.name, mode.colour, type(mode.effect).__name__))
 
         self.lights_on = True
-        self.led.setcolourhex(color)
+        self.animation.play(mode.effect)
+
+    def setModeProgress(self, mode, value):
+        if value is None:
+            self._logger.warning(
+                "No value supplied with progress style effect, ignoring")
+            return
+
+        # Base colour to mode colour gradient across the chained modules
+        self.lights_on = True
+        self.animation.clear()
+        self.led.post(self.renderer.progress(mode.base, mode.colour, value), self.current_effect)
+
+        self.current_state = mode.name
+        self.current_value = value
+
+    def setM150(self, cmd):
+        command = parse_m150(cmd)
+        colour = bytes(command.colour())
+
+        if self.m150_pixels is None or len(self.m150_pixels) != 3 * self.renderer.pixel_count:
+            self.m150_pixels = bytearray(3 * self.renderer.pixel_count)
+
+        if command.index is None:
+            self.m150_pixels[:] = colour * self.renderer.pixel_count
+        elif command.index < self.renderer.pixel_count:
+            self.m150_pixels[3 * command.index:3 * command.index + 3] = colour
+
+        self.lights_on = True
+
+        # Bursts are coalesced, only the colours at the end of each interval reach the strip
+        if self.m150_timer is None:
+            self.m150_timer = self.scheduler.call_later(self.config.m150_interval, self.showM150)
+
+    def showM150(self):
+        self.m150_timer = None
+        self.animation.clear()
+        self.led.post(self.renderer.apply(self.m150_pixels), self.current_effect)
+
+    def setFrames(self, frames, interval):
+        # Plays the frames on the scheduler against fixed deadlines, the last one stays on
+        self.lights_on = True
+        self.animation.clear()
+        self.frame_sequence = frames
+        self.showFrame(frames, 0, interval, self.scheduler.clock.time())
+
+    def showFrame(self, frames, index, interval, started):
+        if frames is not self.frame_sequence:
+            return  # Replaced by another effect
+
+        self.frame_pixels = frames[index]
+        self.led.post(self.renderer.apply(self.frame_pixels), self.current_effect)
+
+        index += 1
+        if index < len(frames):
+            self.frame_timer = self.scheduler.call_at(
+                started + index * interval, self.showFrame, frames, index, interval, started)
+        else:
+            self.frame_timer = None
 
     def restart_strip(self):
         self._logger.debug("Restarting Lights")
 
-        if self.led is not None:
-            self.led.cleanup()
+        self.stop_strip()
+
+        previous = self.strip_settings
+        self.strip_settings = strip_settings = self.get_strip_settings()
+
+        if previous is None or (previous['trace'], previous['pixel_count']) != (
+                strip_settings['trace'], strip_settings['pixel_count']):
+            self.open_trace(strip_settings)
+
+        # The backend is opened on the output worker, effects set meanwhile are shown once it's ready
+        self.led = LEDWorker(LEDStrip(
+            pixel_count=strip_settings['pixel_count'],
+            refresh_interval=self._settings.get_float(['refresh_interval']),
+            trace=self.trace,
+            metrics=self.metrics), opener=functools.partial(self.open_strip, strip_settings))
+
+        self.renderer = self.create_renderer()
+        self.animation = AnimationEngine(self.showColor, self.scheduler)
+        self.led.start()
+        self.setColor(OFF)
+
+    def open_strip(self, strip_settings, strip):
+        # Runs on the output worker, see LEDWorker
+        started = time.perf_counter()
+        backend_options = strip_settings['backend']
+
+        try:
+            backend = None
+            if strip_settings['driver_process']:
+                try:
+                    from octoprint_P9813LedControl.driver import DriverProcessBackend
+                    backend = DriverProcessBackend(
+                        backend_options, trace_frame_size(strip_settings['pixel_count']), logger=self._logger)
+                except ImportError:
+                    self._logger.warning(
+                        "Shared memory is not available on this Python version, driving the LEDs in process")
+
+            in_process = backend is None
+            if in_process:
+                backend = create_backend(logger=self._logger, **backend_options)
+        except Exception:
+            self._logger.exception("Could not open the {} LED backend".format(backend_options['name']))
+            return
+
+        strip.backend = backend
+        self._logger.info("LED strip opened in {:.1f} ms".format((time.perf_counter() - started) * 1e3))
+
+        if in_process and self._settings.get_boolean(['bus_calibrate']):
+            frame_time, bit_rate = strip.calibrate()
+            self._logger.info("LED bus calibration: {:.0f} us per frame, {:.0f} bit/s".format(
+                frame_time * 1e6, bit_rate))
+
+        # Imported here rather than by the first progress frame, which would hold up the scheduler
+        load_numpy()
+
+    def get_strip_settings(self):
+        # Settings that need the strip to be reopened when they change
+        return dict(
+            backend=dict(
+                name=self._settings.get(['led_backend']),
+                clock=self._settings.get_int(['ledgpio_clk']),
+                data=self._settings.get_int(['ledgpio_data']),
+                speed_hz=self._settings.get_int(['bus_speed_hz']),
+                spi_bus=self._settings.get_int(['spi_bus']),
+                spi_device=self._settings.get_int(['spi_device']),
+                spi_speed_hz=self._settings.get_int(['spi_speed_hz'])),
+            driver_process=self._settings.get_boolean(['driver_process']),
+            pixel_count=self._settings.get_int(['pixel_count']),
+            trace=dict(
+                frames=self._settings.get_int(['trace_frames']),
+                file=self._settings.get_boolean(['trace_file'])))
+
+    def open_trace(self, strip_settings):
+        # The trace is kept across restarts of the strip, unless its settings or the chain length changed
+        self.close_trace()
+
+        options = strip_settings['trace']
+        if options['frames'] <= 0:
+            return
+
+        path = None
+        if options['file']:
+            path = os.path.join(self.get_plugin_data_folder(), TRACE_FILE)
+        self.trace = FrameTrace(
+            options['frames'], trace_frame_size(strip_settings['pixel_count']), path=path)
+        self._logger.debug("Tracing the last {} frames{}".format(
+            options['frames'], ' to {}'.format(path) if path else ''))
+
+    def close_trace(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def create_renderer(self):
+        return PixelRenderer(
+            self.led.strip.pixel_count,
+            brightness=self._settings.get_int(['brightness']),
+            gamma=self._settings.get_float(['gamma']))
+
+    def reconfigure_strip(self):
+        # Applies changed settings to the open strip, it is only reopened when the hardware settings changed
+        self.load_config()
+
+        if self.led is None or self.get_strip_settings() != self.strip_settings:
+            self.restart_strip()
+            self.rerender()
+            return
+
+        self._logger.debug("Updating the lights in place")
+        self.led.strip.refresh_interval = self._settings.get_float(['refresh_interval'])
+        self.renderer = self.create_renderer()
+        self.rerender()
+
+    def rerender(self):
+        # Shows the current effect again, e.g. with new colours or brightness
+        self.animation.clear()
+
+        if self.current_effect == 'M150':
+            if self.m150_pixels is not None and len(self.m150_pixels) == 3 * self.renderer.pixel_count:
+                self.showM150()
+            return
 
-        self.led = LEDStrip(self._settings.get_int(
-            ['ledgpio_clk']), self._settings.get_int(['ledgpio_data']))
-        self.led.setcolouroff()
+        if self.current_effect == 'frame':
+            if self.frame_pixels is not None and len(self.frame_pixels) == 3 * self.renderer.pixel_count:
+                self.led.post(self.renderer.apply(self.frame_pixels), self.current_effect)
+            return
+
+        value = self.current_value if self.current_effect == self.current_state else None
+        self.update_effect(self.current_effect, value)
+
+    def stop_strip(self):
+        if self.led is None:
+            return
 
-    @ staticmethod
-    def calculate_heatup_progress(current, target):
-        return round((current / target) * 100)
+        self.animation.clear()
+        self.led.stop()
+        self._logger.info("LED strip stopped, sent {} frames and skipped {} unchanged frames".format(
+            self.led.strip.frames_sent, self.led.strip.frames_skipped))
 
     def process_gcode_q(self, comm_instance, phase, cmd, cmd_type, gcode, subcode=None, tags=None, *args, **kwargs):
-        if not self._settings.get_boolean(['progress_heatup_bed_enabled']) and not self._settings.get_boolean(['progress_heatup_tool_enabled']) and not self._settings.get_boolean(['intercept_m150']):
+        started = time.perf_counter()
+        try:
+            return self.handle_gcode_q(cmd, gcode)
+        finally:
+            self.metrics.gcode_hook.record(time.perf_counter() - started)
+
+    def handle_gcode_q(self, cmd, gcode):
+        if gcode not in HOOK_GCODES:
+            if self.heating:
+                self.set_heating(False)
             return
 
-        if gcode in BLOCKING_TEMP_GCODES and (self._settings.get_boolean(['progress_heatup_bed_enabled']) or self._settings.get_boolean(['progress_heatup_tool_enabled'])):
-            bed_or_tool = {
-                'M109': 'T{}'.format(self.tool_to_target) if self._settings.get_boolean(['progress_heatup_tool_enabled']) else None,
-                'M190': 'B' if self._settings.get_boolean(['progress_heatup_bed_enabled']) else None
-            }
-            if (gcode in BLOCKING_TEMP_GCODES) and bed_or_tool[gcode]:
-                self.heating = True
-                self.current_heater_heating = bed_or_tool[gcode]
-            else:
-                self.heating = False
-        else:
-            self.heating = False
+        config = self.config
+        if gcode in BLOCKING_TEMP_GCODES:
+            if config.heatup_gcodes[gcode]:
+                if not self.heating:
+                    self.start_heatup(config)
+            elif self.heating:
+                self.set_heating(False)
+            return
 
-        if gcode == 'M150' and self._settings.get_boolean(['intercept_m150']):
+        if self.heating:
+            self.set_heating(False)
+        if config.intercept_m150:
             self.update_effect('M150', m150=cmd)
             return None,
 
         return
 
+    def start_heatup(self, config):
+        # The tracker is rebuilt on the comm thread when the settings changed since the last heat-up
+        if self.heatup_config is not config:
+            self.heatup = HeatupTracker(
+                steps=config.heatup_steps,
+                hysteresis=config.heatup_hysteresis,
+                tools=config.heatup_tool_enabled,
+                bed=config.heatup_bed_enabled)
+            self.heatup_config = config
+        else:
+            self.heatup.reset()
+        self.set_heating(True)
+
+    def set_heating(self, heating):
+        # Only called on changes, the scheduler thread gets its own copy through a command
+        self.heating = heating
+        self.submit(self.apply_heating, heating)
+
+    def apply_heating(self, heating):
+        self.heatup_active = heating
+
     def temperatures_received(self, comm_instance, parsed_temperatures, *args, **kwargs):
-        if self.heating and self.current_heater_heating:
-            try:
-                current_temp, target_temp = parsed_temperatures[self.current_heater_heating]
-            except KeyError:
-                self._logger.error("Could not find temperature of tool T{}, not able to show heatup progress.".format(
-                    self.current_heater_heating))
-                self.heating = False
-                return
-            if target_temp:  # Sometimes we don't get everything, so to update more frequently we'll store the target
-                self.temp_target = target_temp
-            if self.temp_target > 0:  # Prevent ZeroDivisionError, or showing progress when target is zero
-                self.update_effect('progress_heatup', self.calculate_heatup_progress(
-                    current_temp, self.temp_target))
+        started = time.perf_counter()
+        try:
+            self.handle_temperatures(parsed_temperatures)
+        finally:
+            self.metrics.temperatures_hook.record(time.perf_counter() - started)
         return parsed_temperatures
 
+    def handle_temperatures(self, temperatures):
+        if self.heating:
+            progress = self.heatup.update(temperatures)
+            if progress is not None:
+                self.update_effect('progress_heatup', progress)
+
     def process_at_command(self, comm, phase, command, parameters, tags=None, *args, **kwargs):
         if command not in AT_COMMANDS or not self._settings.get(['at_command_reaction']):
             return
 
         if command == ON_AT_COMMAND:
             self._logger.debug("Recieved gcode @ command for lights on")
-            self.lights_on = True
             self.update_effect('on')
         elif command == OFF_AT_COMMAND:
             self._logger.debug("Recieved gcode @ command for lights off")
-            self.lights_on = False
             self.update_effect('off')
 
     # ~~ SettingsPlugin mixin
 
     def get_settings_defaults(self):
         return dict(
+            led_backend='bitbang',  # bitbang, spi or gpiomem
             ledgpio_clk=13,
             ledgpio_data=12,
+            bus_speed_hz=0,  # Clock rate of the bit-banged bus, 0 runs it as fast as possible
+            bus_calibrate=True,  # Measure and log the achieved bus speed on startup
+            pixel_count=1,  # Number of daisy-chained P9813 modules
+            brightness=100,  # Percent
+            gamma=1.0,  # Gamma correction, 1.0 sends colours unchanged
+            spi_bus=0,
+            spi_device=0,
+            spi_speed_hz=500000,
+            refresh_interval=0,  # Seconds between forced resends of an unchanged frame, 0 disables
+            driver_process=False,  # Drive the LEDs from a separate process
+            trace_frames=1024,  # Number of sent frames kept in the trace, 0 disables it
+            trace_file=False,  # Keep the trace in a file in the plugin's data folder, it survives crashes
 
             idle_enabled=True,
             idle_color='#00ccf0',
+            idle_effect='solid',
             idle_delay='75',
 
             failed_enabled=True,
             failed_color='#ff0000',
+            failed_effect='blink',
             failed_delay='10',
 
             success_enabled=True,
             success_color='#000000',
+            success_effect='solid',
             success_delay='25',
             success_return_idle='0',
 
             paused_enabled=True,
             paused_color='#0000ff',
+            paused_effect='breathing',
             paused_delay='40',
 
             progress_print_enabled=True,
@@ -317,18 +783,44 @@ class P9813LedControlPlugin(
 
             printing_enabled=False,
             printing_color='#ffffff',
+            printing_effect='solid',
             printing_delay=1,
 
             progress_heatup_enabled=True,
+            progress_heatup_color_base='#000000',
             progress_heatup_color='#ff0000',
             progress_heatup_tool_enabled=True,
             progress_heatup_bed_enabled=True,
-            progress_heatup_tool_key=0,
+            progress_heatup_steps=20,  # The heat-up progress is shown in this many steps
+            progress_heatup_hysteresis=1.0,  # Percent past a step boundary before the next step is shown
+
+            intercept_m150=False,
+            m150_interval=50,  # ms, M150 commands within this interval only show the last colour
+
+            layer_schedule_enabled=False,  # Analyse selected files and follow their layers during the print
+            layer_final_count=3,  # Number of final layers
+            layer_infill_threshold=50,  # Percent of a layer's extrusions in infill making it infill-heavy
+
+            layer_first_enabled=True,
+            layer_first_color='#ffffff',
+            layer_first_effect='solid',
+            layer_first_delay=1,
+
+            layer_infill_enabled=True,
+            layer_infill_color='#ffa500',
+            layer_infill_effect='solid',
+            layer_infill_delay=1,
+
+            layer_final_enabled=True,
+            layer_final_color='#00ff00',
+            layer_final_effect='breathing',
+            layer_final_delay=10,
 
             auto_off_time=600,
 
             torch_enabled=True,
             torch_color='#ffffff',
+            torch_effect='solid',
             torch_delay=1,
             torch_timer=15,
         )
@@ -337,12 +829,8 @@ class P9813LedControlPlugin(
     def on_settings_save(self, data):
         octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
 
-        self.tool_to_target = self._settings.get_int(
-            ['progress_heatup_tool_key'])
-        if not self.tool_to_target:
-            self.tool_to_target = 0
-
-        self.restart_strip()
+        # The config is rebuilt by the command, on the scheduler thread like every other change
+        self.submit(self.reconfigure_strip, wait=True)
 
     # ~~ AssetPlugin mixin
 
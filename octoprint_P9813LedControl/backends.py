@@ -0,0 +1,296 @@
+# Output backends for the P9813 bus. A backend receives complete, ready to send
+# frames (start frame, colour data, end frame) as bytes and puts them on the wire.
+
+import logging
+import mmap
+import os
+import tempfile
+import time
+
+BACKEND_BITBANG = 'bitbang'
+BACKEND_SPI = 'spi'
+BACKEND_GPIOMEM = 'gpiomem'
+BACKENDS = [BACKEND_BITBANG, BACKEND_SPI, BACKEND_GPIOMEM]
+
+# BCM283x/BCM2711 GPIO register block as mapped by /dev/gpiomem, in 32 bit words
+GPIOMEM_PATH = '/dev/gpiomem'
+GPIOMEM_SIZE = 4096
+GPFSEL0 = 0x00 // 4
+GPSET0 = 0x1c // 4
+GPCLR0 = 0x28 // 4
+
+# Half clock periods shorter than this are busy-waited, sleep() overshoots them by far
+BUSY_WAIT_LIMIT = 0.001
+
+
+def busywait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def create_delay(speed_hz):
+    # Returns the wait between clock edges for the bus speed, None to run as fast as possible
+    if not speed_hz or speed_hz <= 0:
+        return None
+
+    halfperiod = 0.5 / speed_hz
+    if halfperiod < BUSY_WAIT_LIMIT:
+        return lambda: busywait(halfperiod)
+    return lambda: time.sleep(halfperiod)
+
+
+class OutputBackend:
+
+    def write(self, frame):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class BitBangBackend(OutputBackend):
+    # Toggles the clock and data pins through gpiozero, one call per edge
+
+    def __init__(self, clock, data, speed_hz=0, pin_factory=None):
+        self.__clock = clock
+        self.__data = data
+        self.__delay = create_delay(speed_hz)
+        self.__factory = None  # Mock pins owned by this backend, closed with it
+
+        try:
+            self.__clockLed, self.__dataLed = self.__open(pin_factory)
+        except (ImportError, RuntimeError):
+            # Revert to mock pins if not running on raspberry pi. They are
+            # scoped to this backend, gpiozero's global Device.pin_factory
+            # is shared with other plugins and left alone.
+            from gpiozero.pins.mock import MockFactory
+            self.__factory = MockFactory()
+            self.__clockLed, self.__dataLed = self.__open(self.__factory)
+
+    def __open(self, pin_factory):
+        # gpiozero is imported here, only once a bit-banged strip is opened
+        from gpiozero import LED
+
+        clockLed = LED(self.__clock, pin_factory=pin_factory)
+        try:
+            return clockLed, LED(self.__data, pin_factory=pin_factory)
+        except Exception:
+            clockLed.close()
+            raise
+
+    def write(self, frame):
+        clockLed = self.__clockLed
+        dataLed = self.__dataLed
+        delay = self.__delay
+
+        for byte in frame:
+            for x in range(8):
+                if ((byte & 0x80) != 0):
+                    dataLed.on()
+                else:
+                    dataLed.off()
+
+                byte <<= 1
+                clockLed.off()
+                if delay is not None:
+                    delay()
+                clockLed.on()
+                if delay is not None:
+                    delay()
+
+    def close(self):
+        self.__clockLed.close()
+        self.__dataLed.close()
+        if self.__factory is not None:
+            self.__factory.close()
+
+
+class FakeSpiDev:
+    # In-process stand-in for spidev.SpiDev. With record, e.g. for tests and
+    # replays, every transfer is kept in transfers. Recording is off for the
+    # fallback on machines without SPI, it would grow with every frame.
+
+    def __init__(self, record=False):
+        self.bus = None
+        self.device = None
+        self.mode = 0
+        self.max_speed_hz = 0
+        self.record = record
+        self.transfers = []
+        self.closed = True
+
+    def open(self, bus, device):
+        self.bus = bus
+        self.device = device
+        self.closed = False
+
+    def xfer(self, values):
+        if self.closed:
+            raise IOError("SPI device is not open")
+
+        if self.record:
+            self.transfers.append(bytes(values))
+        return [0] * len(values)
+
+    xfer2 = xfer
+
+    def writebytes(self, values):
+        self.xfer(values)
+
+    def close(self):
+        self.closed = True
+
+
+class SPIBackend(OutputBackend):
+    # Pushes the whole frame through the SPI peripheral in one transfer,
+    # wire CLK to SCLK and DATA to MOSI.
+
+    def __init__(self, bus=0, device=0, speed_hz=500000, spi_factory=None, logger=None):
+        if spi_factory is None:
+            try:
+                import spidev
+                spi = spidev.SpiDev()
+                spi.open(bus, device)
+            except (ImportError, IOError) as error:
+                # Revert to a fake device if not running on raspberry pi
+                logger = logger if logger is not None else logging.getLogger(__name__)
+                logger.warning("Could not open SPI device {}.{} ({}), the LEDs won't light: "
+                               "install python3-spidev and enable SPI".format(bus, device, error))
+                spi = FakeSpiDev()
+                spi.open(bus, device)
+        else:
+            spi = spi_factory()
+            spi.open(bus, device)
+
+        spi.mode = 0
+        spi.max_speed_hz = int(speed_hz)
+        self.__spi = spi
+
+    @property
+    def device(self):
+        return self.__spi
+
+    def write(self, frame):
+        self.__spi.xfer(list(frame))
+
+    def close(self):
+        self.__spi.close()
+
+
+class GpioMemBackend(OutputBackend):
+    # Writes the GPIO set/clear registers directly through an mmap of
+    # /dev/gpiomem, skipping gpiozero's per-edge locking and property calls
+    # and the sleep syscalls. Any regular file of at least GPIOMEM_SIZE bytes
+    # can stand in for the device, e.g. for tests on non-Pi Linux.
+
+    def __init__(self, clock, data, speed_hz=0, path=GPIOMEM_PATH, logger=None):
+        self.__scratch = not os.path.exists(path)
+        if self.__scratch:
+            # Revert to a scratch file if not running on raspberry pi
+            logger = logger if logger is not None else logging.getLogger(__name__)
+            logger.warning("{} does not exist, the LEDs won't light: the gpiomem backend needs a "
+                           "Raspberry Pi up to the Pi 4, use bitbang or spi otherwise".format(path))
+            path = create_gpiomem_standin()
+
+        self.path = path
+        self.__fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        self.__mem = mmap.mmap(self.__fd, GPIOMEM_SIZE)
+        self.__registers = memoryview(self.__mem).cast('I')
+
+        self.__clock = clock
+        self.__data = data
+        self.__clockMask = 1 << clock
+        self.__dataMask = 1 << data
+        self.__delay = create_delay(speed_hz)
+
+        # The data register to write for every bit of every byte value, MSB first
+        self.__bits = [
+            tuple(GPSET0 if byte & (0x80 >> bit) else GPCLR0 for bit in range(8)) for byte in range(256)]
+
+        for pin in (clock, data):
+            self.__setfunction(pin, 1)
+        self.__registers[GPCLR0] = self.__clockMask | self.__dataMask
+
+    @property
+    def registers(self):
+        return self.__registers
+
+    def __setfunction(self, pin, function):
+        # 3 bits per pin, 0 is input and 1 output
+        index = GPFSEL0 + pin // 10
+        shift = (pin % 10) * 3
+        self.__registers[index] = (self.__registers[index] & ~(7 << shift)) | (function << shift)
+
+    def write(self, frame):
+        registers = self.__registers
+        bits = self.__bits
+        clockMask = self.__clockMask
+        dataMask = self.__dataMask
+        delay = self.__delay
+
+        if delay is None:
+            for byte in frame:
+                for register in bits[byte]:
+                    registers[register] = dataMask
+                    registers[GPCLR0] = clockMask
+                    registers[GPSET0] = clockMask
+            return
+
+        for byte in frame:
+            for register in bits[byte]:
+                registers[register] = dataMask
+                registers[GPCLR0] = clockMask
+                delay()
+                registers[GPSET0] = clockMask
+                delay()
+
+    def close(self):
+        for pin in (self.__clock, self.__data):
+            self.__setfunction(pin, 0)
+
+        self.__registers.release()
+        self.__mem.close()
+        os.close(self.__fd)
+
+        if self.__scratch:
+            os.remove(self.path)
+
+
+def create_gpiomem_standin(path=None):
+    # A zeroed file the size of the GPIO register block
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix='P9813LedControl-gpiomem-')
+        os.close(fd)
+
+    with open(path, 'wb') as f:
+        f.write(bytes(GPIOMEM_SIZE))
+    return path
+
+
+def create_backend(name, clock, data, speed_hz=0, spi_bus=0, spi_device=0, spi_speed_hz=500000, logger=None,
+                   pin_factory=None):
+    # speed_hz is the clock rate of the bit-banged backends, 0 runs them as fast as possible.
+    # pin_factory is the gpiozero pin factory of the bitbang backend, gpiozero's default when None
+    if name == BACKEND_SPI:
+        return SPIBackend(spi_bus, spi_device, spi_speed_hz, logger=logger)
+
+    if name == BACKEND_GPIOMEM:
+        return GpioMemBackend(clock, data, speed_hz, logger=logger)
+
+    return BitBangBackend(clock, data, speed_hz, pin_factory=pin_factory)
+
+
+def calibrate(backend, frame, frames=10, limit=0.25):
+    # Times sending the frame up to frames times, stopping early after limit
+    # seconds on slow buses. Returns (seconds per frame, achieved bits per second)
+    started = time.perf_counter()
+    sent = 0
+    while sent < frames:
+        backend.write(frame)
+        sent += 1
+        if time.perf_counter() - started > limit:
+            break
+    frametime = (time.perf_counter() - started) / sent
+
+    return frametime, len(frame) * 8 / frametime if frametime else 0
@@ -0,0 +1,148 @@
+# Immutable snapshot of the settings read on hot paths. OctoPrint's settings
+# lookups walk the settings tree on every call, the gcode queued hook runs for
+# every line of a print, so it reads this snapshot instead. A new snapshot is
+# built on startup and whenever the settings are saved.
+#
+# The snapshot also holds the compiled effect table: one ModeConfig per mode
+# with its enabled flag, parsed colours, effect and timeout, so switching
+# modes doesn't read or parse any settings.
+
+from octoprint_P9813LedControl.effects import create_effect
+from octoprint_P9813LedControl.ledstrip import hextorgb
+
+# Gcodes the queued hook has to look at, every other line is rejected with a single membership test
+HOOK_GCODES = frozenset(['M109', 'M190', 'M150'])
+
+# How each mode is shown
+KIND_ON = 'on'
+KIND_OFF = 'off'
+KIND_EFFECT = 'effect'  # The <mode>_color played with the <mode>_effect
+KIND_TORCH = 'torch'  # Like KIND_EFFECT, but only while the torch is on
+KIND_PROGRESS = 'progress'  # Gradient from <mode>_color_base to <mode>_color
+
+MODE_KINDS = {
+    'on': KIND_ON,
+    'off': KIND_OFF,
+    'disconnected': KIND_OFF,
+    'torch': KIND_TORCH,
+    'idle': KIND_EFFECT,
+    'paused': KIND_EFFECT,
+    'failed': KIND_EFFECT,
+    'printing': KIND_EFFECT,
+    'success': KIND_EFFECT,
+    'progress_heatup': KIND_PROGRESS,
+    'progress_print': KIND_PROGRESS,
+    'layer_first': KIND_EFFECT,
+    'layer_infill': KIND_EFFECT,
+    'layer_final': KIND_EFFECT
+}
+
+# Modes switching to another mode after a timeout: setting holding the seconds, mode switched to
+MODE_TIMEOUTS = {
+    'idle': ('auto_off_time', 'off'),
+    'success': ('success_return_idle', 'idle')
+}
+
+OFF = (0, 0, 0)
+
+
+def parsecolour(value, logger=None):
+    try:
+        return hextorgb(value.strip('#'))
+    except (AttributeError, ValueError):
+        if logger is not None:
+            logger.warning("Could not convert {} to a colour".format(value))
+        return OFF
+
+
+class ModeConfig:
+    __slots__ = ('name', 'kind', 'enabled', 'colour', 'base', 'effect', 'timeout', 'then')
+
+    def __init__(self, name, kind, enabled=True, colour=OFF, base=OFF, effect=None, timeout=0, then=None):
+        set = object.__setattr__
+        set(self, 'name', name)
+        set(self, 'kind', kind)
+        set(self, 'enabled', enabled)
+        set(self, 'colour', colour)
+        set(self, 'base', base)  # Start of the gradient of progress modes
+        set(self, 'effect', effect)  # Prebuilt Effect of effect and torch modes
+        set(self, 'timeout', timeout)  # Seconds until switching to the mode then, 0 stays
+        set(self, 'then', then)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ModeConfig is immutable, build a new one instead")
+
+    __delattr__ = __setattr__
+
+    @classmethod
+    def from_settings(cls, name, kind, settings, logger=None):
+        enabled = True
+        if kind not in (KIND_ON, KIND_OFF):
+            enabled = bool(settings.get_boolean(['{}_enabled'.format(name)]))
+
+        colour = base = OFF
+        effect = None
+        if kind in (KIND_EFFECT, KIND_TORCH, KIND_PROGRESS):
+            colour = parsecolour(settings.get(['{}_color'.format(name)]), logger)
+        if kind == KIND_PROGRESS:
+            base = parsecolour(settings.get(['{}_color_base'.format(name)]), logger)
+        if kind in (KIND_EFFECT, KIND_TORCH):
+            effect = create_effect(
+                settings.get(['{}_effect'.format(name)]), colour, settings.get_int(['{}_delay'.format(name)]))
+
+        timeout, then = 0, None
+        if name in MODE_TIMEOUTS:
+            key, then = MODE_TIMEOUTS[name]
+            timeout = max(0, settings.get_int([key]) or 0)
+
+        return cls(name, kind, enabled=enabled, colour=colour, base=base, effect=effect, timeout=timeout, then=then)
+
+
+def compile_modes(settings, logger=None):
+    return dict((name, ModeConfig.from_settings(name, kind, settings, logger)) for name, kind in MODE_KINDS.items())
+
+
+class PluginConfig:
+    __slots__ = (
+        'heatup_tool_enabled',
+        'heatup_bed_enabled',
+        'heatup_steps',
+        'heatup_hysteresis',
+        'intercept_m150',
+        'm150_interval',
+        'heatup_gcodes',
+        'modes',
+    )
+
+    def __init__(self, heatup_tool_enabled=True, heatup_bed_enabled=True, heatup_steps=20, heatup_hysteresis=1.0,
+                 intercept_m150=False, m150_interval=0.05, modes=None):
+        set = object.__setattr__
+        set(self, 'heatup_tool_enabled', heatup_tool_enabled)
+        set(self, 'heatup_bed_enabled', heatup_bed_enabled)
+        set(self, 'heatup_steps', heatup_steps)
+        set(self, 'heatup_hysteresis', heatup_hysteresis)  # Percent, see HeatupTracker
+        set(self, 'intercept_m150', intercept_m150)
+        set(self, 'm150_interval', m150_interval)  # Seconds, M150s within one interval are coalesced
+
+        # Whether each blocking temperature gcode starts tracking the heat-up
+        set(self, 'heatup_gcodes', {
+            'M109': heatup_tool_enabled,
+            'M190': heatup_bed_enabled
+        })
+        set(self, 'modes', modes or {})  # Mode name to ModeConfig
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PluginConfig is immutable, build a new one instead")
+
+    __delattr__ = __setattr__
+
+    @classmethod
+    def from_settings(cls, settings, logger=None):
+        return cls(
+            heatup_tool_enabled=bool(settings.get_boolean(['progress_heatup_tool_enabled'])),
+            heatup_bed_enabled=bool(settings.get_boolean(['progress_heatup_bed_enabled'])),
+            heatup_steps=settings.get_int(['progress_heatup_steps']) or 20,
+            heatup_hysteresis=settings.get_float(['progress_heatup_hysteresis']) or 0.0,
+            intercept_m150=bool(settings.get_boolean(['intercept_m150'])),
+            m150_interval=max(0, settings.get_int(['m150_interval']) or 0) / 1000.0,
+            modes=compile_modes(settings, logger))
@@ -0,0 +1,182 @@
+# Optional out-of-process output. Bit-banging in Python holds the GIL for the
+# whole frame, competing with OctoPrint's serial and web threads, so the
+# backend can instead run in a separate driver process.
+#
+# The plugin writes each frame into a shared memory buffer guarded by a
+# sequence counter (odd while a write is in progress) and wakes the driver,
+# which only ever picks up the newest complete frame. A driver that dies is
+# restarted on the next write.
+#
+# Wakeups are single bytes on a non-blocking pipe rather than a
+# multiprocessing.Event, whose lock would stay held forever if the driver
+# were killed while waiting on it.
+
+import multiprocessing
+import os
+import struct
+import time
+
+from octoprint_P9813LedControl.backends import OutputBackend, create_backend
+
+HEADER = struct.Struct('<QI')  # sequence, frame length
+RESTART_INTERVAL = 1.0  # Minimum seconds between restarts of a crashed driver
+JOIN_TIMEOUT = 5
+
+WAKEUP = b'w'
+STOP = b's'
+
+
+class SharedFrameBuffer:
+
+    def __init__(self, memory, owner=False):
+        self.__memory = memory
+        self.__owner = owner
+        self.capacity = memory.size - HEADER.size
+
+    @classmethod
+    def create(cls, capacity):
+        from multiprocessing import shared_memory
+
+        memory = shared_memory.SharedMemory(create=True, size=HEADER.size + capacity)
+        HEADER.pack_into(memory.buf, 0, 0, 0)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        # The spawned driver shares the plugin's resource tracker, the segment
+        # stays registered once and is unlinked by the owner only
+        from multiprocessing import shared_memory
+
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self.__memory.name
+
+    @property
+    def sequence(self):
+        return HEADER.unpack_from(self.__memory.buf, 0)[0]
+
+    def publish(self, frame):
+        # Single writer only, the plugin's output worker
+        length = len(frame)
+        if length > self.capacity:
+            raise ValueError("Frame of {} bytes exceeds the shared buffer of {} bytes".format(length, self.capacity))
+
+        buf = self.__memory.buf
+        sequence = HEADER.unpack_from(buf, 0)[0]
+        HEADER.pack_into(buf, 0, sequence + 1, length)
+        buf[HEADER.size:HEADER.size + length] = frame
+        HEADER.pack_into(buf, 0, sequence + 2, length)
+
+    def read(self, last_sequence):
+        # Returns (sequence, frame) of the newest complete frame, frame is None if nothing new
+        buf = self.__memory.buf
+        while True:
+            sequence, length = HEADER.unpack_from(buf, 0)
+            if sequence == last_sequence:
+                return sequence, None
+            if sequence & 1:
+                continue
+
+            frame = bytes(buf[HEADER.size:HEADER.size + length])
+            if HEADER.unpack_from(buf, 0)[0] == sequence:
+                return sequence, frame
+
+    def close(self):
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
+
+
+def run_driver(name, pipe, backend_options):
+    # Entry point of the driver process
+    frames = SharedFrameBuffer.attach(name)
+    backend = create_backend(**backend_options)
+    sequence = 0
+
+    try:
+        while True:
+            signals = os.read(pipe.fileno(), 4096)
+
+            sequence, frame = frames.read(sequence)
+            if frame is not None:
+                backend.write(frame)
+
+            # An empty read means the plugin is gone
+            if not signals or STOP in signals:
+                break
+    finally:
+        backend.close()
+        frames.close()
+
+
+class DriverProcessBackend(OutputBackend):
+
+    def __init__(self, backend_options, capacity, logger=None):
+        self.__options = backend_options
+        self.__logger = logger
+        self.__context = multiprocessing.get_context('spawn')
+        self.__frames = SharedFrameBuffer.create(capacity)
+        self.__pipe = None
+        self.__process = None
+        self.__started = 0
+
+        self.restarts = 0
+        self.__start()
+
+    def __start(self):
+        if self.__pipe is not None:
+            self.__pipe.close()
+
+        reader, self.__pipe = self.__context.Pipe(duplex=False)
+        os.set_blocking(self.__pipe.fileno(), False)
+
+        self.__started = time.monotonic()
+        self.__process = self.__context.Process(
+            target=run_driver,
+            name="P9813LedControl driver",
+            args=(self.__frames.name, reader, self.__options))
+        self.__process.daemon = True
+        self.__process.start()
+        reader.close()
+
+        if self.__logger:
+            self.__logger.info("Started LED driver process {}".format(self.__process.pid))
+
+    def __signal(self, signal):
+        try:
+            os.write(self.__pipe.fileno(), signal)
+        except BlockingIOError:
+            pass  # The driver has plenty of wakeups queued already
+        except OSError:
+            pass  # The driver died, it's restarted on the next write
+
+    def __check_alive(self):
+        if self.__process.is_alive():
+            return True
+
+        if time.monotonic() - self.__started < RESTART_INTERVAL:
+            return False
+
+        if self.__logger:
+            self.__logger.warning("LED driver process exited with {}, restarting it".format(self.__process.exitcode))
+        self.restarts += 1
+        self.__start()
+        return True
+
+    def write(self, frame):
+        self.__frames.publish(frame)
+        if self.__check_alive():
+            # A restarted driver picks the newest frame up right away
+            self.__signal(WAKEUP)
+
+    def close(self):
+        self.__signal(STOP)
+        self.__process.join(JOIN_TIMEOUT)
+        if self.__process.is_alive():
+            self.__process.terminate()
+            self.__process.join(JOIN_TIMEOUT)
+
+        self.__pipe.close()
+        self.__frames.close()
@@ -0,0 +1,148 @@
+# Animated effects and the engine playing them. An effect maps the time since
+# it started to a colour, the *_delay settings give the milliseconds per
+# animation step.
+#
+# The engine steps animations at a fixed frame rate on the plugin's scheduler,
+# planned against monotonic deadlines. When output falls behind, late frames
+# are dropped instead of letting the animation drift. Static effects are sent
+# once and nothing is scheduled until the next effect is played.
+
+import colorsys
+import math
+import threading
+
+EFFECT_SOLID = 'solid'
+EFFECT_BREATHING = 'breathing'
+EFFECT_BLINK = 'blink'
+EFFECT_CYCLE = 'cycle'
+EFFECTS = [EFFECT_SOLID, EFFECT_BREATHING, EFFECT_BLINK, EFFECT_CYCLE]
+
+
+class Effect:
+    static = True
+    steps = 1  # Animation steps per cycle
+
+    def __init__(self, colour, delay=0):
+        self.colour = tuple(colour)
+        self.delay = max(1, int(delay or 0)) / 1000.0  # Seconds per step
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.colour == other.colour and self.delay == other.delay
+
+    def __ne__(self, other):
+        return not self == other
+
+    def phase(self, elapsed):
+        # Position within the current cycle, 0.0 <= phase < 1.0
+        return (elapsed / self.delay / self.steps) % 1.0
+
+    def colour_at(self, elapsed):
+        return self.colour
+
+
+class BreathingEffect(Effect):
+    static = False
+    steps = 200
+
+    def colour_at(self, elapsed):
+        level = (1 - math.cos(2 * math.pi * self.phase(elapsed))) / 2
+        return tuple(int(c * level + 0.5) for c in self.colour)
+
+
+class BlinkEffect(Effect):
+    static = False
+    steps = 100
+
+    def colour_at(self, elapsed):
+        return self.colour if self.phase(elapsed) < 0.5 else (0, 0, 0)
+
+
+class ColourCycleEffect(Effect):
+    # Rotates the hue, starting from the configured colour
+    static = False
+    steps = 360
+
+    def __init__(self, colour, delay=0):
+        Effect.__init__(self, colour, delay)
+        self.__hsv = colorsys.rgb_to_hsv(*(c / 255.0 for c in self.colour))
+        if self.__hsv[1] == 0:
+            # Greys have no hue to rotate, cycle through fully saturated colours instead
+            self.__hsv = (self.__hsv[0], 1.0, self.__hsv[2] or 1.0)
+
+    def colour_at(self, elapsed):
+        hue, saturation, value = self.__hsv
+        rgb = colorsys.hsv_to_rgb((hue + self.phase(elapsed)) % 1.0, saturation, value)
+        return tuple(int(c * 255 + 0.5) for c in rgb)
+
+
+EFFECT_CLASSES = {
+    EFFECT_SOLID: Effect,
+    EFFECT_BREATHING: BreathingEffect,
+    EFFECT_BLINK: BlinkEffect,
+    EFFECT_CYCLE: ColourCycleEffect
+}
+
+
+def create_effect(name, colour, delay=0):
+    return EFFECT_CLASSES.get(name, Effect)(colour, delay)
+
+
+class AnimationEngine:
+
+    def __init__(self, output, scheduler, fps=30):
+        self.__output = output  # Called with the (r, g, b) colour of every frame
+        self.__scheduler = scheduler
+        self.__interval = 1.0 / fps
+        self.__effect = None
+        self.__started = 0
+        self.__step = None  # Next scheduled frame
+        self.__lock = threading.Lock()
+
+        self.frames_rendered = 0
+        self.frames_dropped = 0
+
+    @property
+    def effect(self):
+        return self.__effect
+
+    def play(self, effect):
+        with self.__lock:
+            if effect == self.__effect:
+                return
+
+            if self.__step is not None:
+                self.__step.cancel()
+                self.__step = None
+
+            self.__effect = effect
+            if effect is None:
+                return
+
+            if effect.static:
+                self.__output(effect.colour)
+                return
+
+            self.__started = self.__scheduler.clock.time()
+            self.__step = self.__scheduler.call_at(self.__started, self.__render, effect, self.__started)
+
+    def clear(self):
+        # Stops the running effect, once this returns no further frames are output
+        self.play(None)
+
+    def __render(self, effect, deadline):
+        with self.__lock:
+            if self.__effect is not effect:
+                return
+
+            self.__output(effect.colour_at(deadline - self.__started))
+            self.frames_rendered += 1
+
+            now = self.__scheduler.clock.time()
+            deadline += self.__interval
+            if deadline <= now:
+                # Fell behind, skip the missed frames instead of drifting
+                missed = int((now - deadline) / self.__interval) + 1
+                deadline += missed * self.__interval
+                self.frames_dropped += missed
+
+            self.__step = self.__scheduler.call_at(deadline, self.__render, effect, deadline)
@@ -0,0 +1,73 @@
+# Turns colours into ready to send P9813 frames. Only a handful of colours are
+# used during a print (idle, progress, heatup, white, off), so encoded frames
+# are kept in a small LRU cache and re-used instead of being rebuilt each time.
+#
+# A frame covers the whole chain of daisy-chained modules: the start frame,
+# one 32 bit colour word per module and the end frame.
+
+from functools import lru_cache
+
+START_FRAME = bytes(4)
+END_FRAME = bytes(4)
+
+
+def getcode(dat):
+    tmp = 0
+
+    if ((dat & 0x80) == 0):
+        tmp |= 0x02
+
+    if ((dat & 0x40) == 0):
+        tmp |= 0x01
+
+    return tmp
+
+
+def encodeword(red, green, blue):
+    dx = 0
+    dx |= 0x03 << 30
+    dx |= getcode(blue)
+    dx |= getcode(green)
+    dx |= getcode(red)
+    dx |= blue << 16
+    dx |= green << 8
+    dx |= red
+
+    return dx
+
+
+def decodeword(word):
+    # (red, green, blue, valid) of a colour word, valid when encodeword could have produced it
+    red = word & 0xff
+    green = (word >> 8) & 0xff
+    blue = (word >> 16) & 0xff
+
+    return red, green, blue, encodeword(red, green, blue) == word
+
+
+def decodeframe(frame):
+    # Colour words of a frame as (red, green, blue, valid), one per module
+    return [decodeword(int.from_bytes(frame[i:i + 4], 'big'))
+            for i in range(len(START_FRAME), len(frame) - len(END_FRAME), 4)]
+
+
+class FrameEncoder:
+
+    def __init__(self, maxsize=16):
+        self.encodecolour = lru_cache(maxsize=maxsize * 4)(self.__encodecolour)
+        self.__frames = lru_cache(maxsize=maxsize)(self.__encodeframe)
+
+    def __encodecolour(self, red, green, blue):
+        return encodeword(red, green, blue).to_bytes(4, 'big')
+
+    def __encodeframe(self, pixels):
+        encodecolour = self.encodecolour
+        return START_FRAME + b''.join(
+            encodecolour(pixels[i], pixels[i + 1], pixels[i + 2]) for i in range(0, len(pixels), 3)) + END_FRAME
+
+    def encode(self, pixels):
+        # pixels holds one (r, g, b) triplet per module, as bytes, bytearray or array('B')
+        return self.__frames(bytes(pixels))
+
+    def cache_info(self):
+        return self.__frames.cache_info()
@@ -0,0 +1,58 @@
+# Frames set directly through the set_frame API command, e.g. by a farm
+# controller. Pixels are base64 encoded (r, g, b) triplets for the chain, the
+# API's JSON has no way to carry raw binary:
+#
+#   {"command": "set_frame", "pixels": "<base64>"}
+#   {"command": "set_frame", "frames": ["<base64>", ...], "interval": 33}
+#
+# A single triplet fills the whole chain, shorter buffers leave the remaining
+# modules off. A sequence of frames is played on the plugin's scheduler, one
+# frame every interval milliseconds, and the last frame stays on.
+
+import base64
+import binascii
+
+MAX_FRAMES = 1000
+MIN_INTERVAL = 10  # ms
+
+
+class FrameRequestError(ValueError):
+    pass
+
+
+def decode_pixels(text, pixel_count):
+    try:
+        pixels = base64.b64decode(text, validate=True)
+    except (binascii.Error, TypeError, ValueError):
+        raise FrameRequestError("Pixels are not valid base64")
+
+    size = 3 * pixel_count
+    if not pixels or len(pixels) % 3:
+        raise FrameRequestError("Pixels must be (r, g, b) triplets")
+    if len(pixels) > size:
+        raise FrameRequestError("{} pixels sent for a chain of {}".format(len(pixels) // 3, pixel_count))
+
+    if len(pixels) == 3:
+        return pixels * pixel_count
+    return pixels + bytes(size - len(pixels))
+
+
+def parse_frame_request(data, pixel_count):
+    # Returns ([pixels, ...], seconds between frames)
+    if 'frames' in data:
+        frames = data['frames']
+        if not isinstance(frames, list) or not frames:
+            raise FrameRequestError("frames must be a non-empty list")
+        if len(frames) > MAX_FRAMES:
+            raise FrameRequestError("At most {} frames per request".format(MAX_FRAMES))
+    elif 'pixels' in data:
+        frames = [data['pixels']]
+    else:
+        raise FrameRequestError("Either pixels or frames is required")
+
+    try:
+        interval = int(data.get('interval', MIN_INTERVAL))
+    except (TypeError, ValueError):
+        raise FrameRequestError("interval must be a number of milliseconds")
+
+    return [decode_pixels(frame, pixel_count) for frame in frames], max(MIN_INTERVAL, interval) / 1000.0
@@ -0,0 +1,75 @@
+# Heat-up progress across all active heaters. The progress shown is the one
+# of the heater furthest from its target, quantised into steps so that the
+# strip is only re-rendered when the displayed step changes. A hysteresis
+# around the step boundaries keeps a temperature hovering at a boundary from
+# flipping between two steps on every report.
+
+
+class HeatupTracker:
+
+    def __init__(self, steps=20, hysteresis=1.0, tools=True, bed=True):
+        self.step_size = 100.0 / max(1, steps)
+        self.hysteresis = max(0.0, hysteresis)  # In percent of the heat-up progress
+        self.tools = tools
+        self.bed = bed
+
+        self.targets = {}  # Last known target per heater, not every report carries them
+        self.step = None  # Displayed step, None until the first report
+
+    def reset(self):
+        self.step = None
+
+    def tracked(self, heater):
+        if heater == 'B':
+            return self.bed
+        if heater[:1] == 'T':
+            return self.tools
+        return True
+
+    def update(self, temperatures):
+        # Returns the progress to display, None when the displayed step didn't change
+        lowest = None
+        targets = self.targets
+        for heater, (current, target) in temperatures.items():
+            if not self.tracked(heater):
+                continue
+
+            if target is None:
+                target = targets.get(heater)
+            elif target > 0:
+                targets[heater] = target
+            else:
+                # Heater switched off
+                targets.pop(heater, None)
+                continue
+
+            if not target or current is None:
+                continue
+
+            progress = current / target * 100
+            if lowest is None or progress < lowest:
+                lowest = progress
+
+        if lowest is None:
+            return None
+
+        step = self.quantise(min(100.0, max(0.0, lowest)))
+        if step == self.step:
+            return None
+
+        self.step = step
+        return min(100.0, step * self.step_size)
+
+    def quantise(self, progress):
+        step = int(progress / self.step_size)
+        current = self.step
+        if current is None or step == current:
+            return step
+
+        # Only leave the displayed step once the progress is clearly past its bounds,
+        # the last step is reached at 100% whatever the hysteresis
+        if step > current and progress < min(100.0, (current + 1) * self.step_size + self.hysteresis):
+            return current
+        if step < current and progress > current * self.step_size - self.hysteresis:
+            return current
+        return step
@@ -0,0 +1,189 @@
+# Per-layer colour schedule of a gcode file. When a file is selected it is
+# streamed once, line by line, and every layer is assigned a phase: the first
+# layer, infill-heavy layers, the final layers or none. The result is folded
+# into a table of 101 phases, one per percent of print progress, so finding
+# the phase during the print is a single index into it.
+#
+# OctoPrint reports the progress of local files by file position, so the
+# table maps file positions too: entry p holds the phase of the layer at
+# p percent of the file. Memory stays constant however long the file is,
+# only the last final_layers layers are held back until the end of the file
+# tells which layers are final.
+#
+# Layers are found through the layer change comments of the common slicers
+# (Cura, PrusaSlicer and its forks, Simplify3D, KISSlicer), infill through
+# their feature type comments.
+
+import collections
+import hashlib
+import os
+
+PHASE_NONE = 0
+PHASE_FIRST = 1
+PHASE_INFILL = 2
+PHASE_FINAL = 3
+
+# Effect table mode shown for each phase, see config.py
+PHASE_MODES = {
+    PHASE_FIRST: 'layer_first',
+    PHASE_INFILL: 'layer_infill',
+    PHASE_FINAL: 'layer_final'
+}
+
+STEPS = 101  # One phase per percent, 0 to 100
+LAYER_COMMENTS = (b';LAYER:', b';LAYER_CHANGE', b'; layer ', b'; BEGIN_LAYER')
+TYPE_COMMENTS = (b';TYPE:', b'; feature ')
+INFILL_TYPES = frozenset([b'fill', b'infill', b'internal infill', b'sparse infill'])
+
+
+class LayerSchedule:
+    __slots__ = ('phases', 'layers')
+
+    def __init__(self, phases=bytes(STEPS), layers=0):
+        self.phases = bytes(phases)
+        self.layers = layers
+
+    def phase_at(self, progress):
+        index = int(progress)
+        return self.phases[0 if index < 0 else STEPS - 1 if index >= STEPS else index]
+
+
+class ScheduleBuilder:
+
+    def __init__(self, size, final_layers=3, infill_threshold=0.5):
+        self.size = max(1, size)
+        self.final_layers = max(0, final_layers)
+        self.infill_threshold = infill_threshold
+
+        self.phases = bytearray(STEPS)
+        self.layers = 0
+        self.pending = collections.deque()  # (start, end, phase) of the last layers, which may be final
+
+        self.start = None  # File position where the current layer started
+        self.extrusions = 0
+        self.infill_extrusions = 0
+        self.infill = False
+
+    def feed(self, line, position):
+        # line starts at position in the file
+        if line[:1] == b';':
+            if line.startswith(LAYER_COMMENTS):
+                self.close_layer(position)
+                self.start = position
+            else:
+                for prefix in TYPE_COMMENTS:
+                    if line.startswith(prefix):
+                        self.infill = line[len(prefix):].strip().lower() in INFILL_TYPES
+                        break
+            return
+
+        if self.start is not None and line[:2] == b'G1' and b'E' in line:
+            self.extrusions += 1
+            if self.infill:
+                self.infill_extrusions += 1
+
+    def close_layer(self, end):
+        if self.start is None:
+            return
+
+        if self.layers == 0:
+            phase = PHASE_FIRST
+        elif self.extrusions and self.infill_extrusions >= self.infill_threshold * self.extrusions:
+            phase = PHASE_INFILL
+        else:
+            phase = PHASE_NONE
+
+        self.layers += 1
+        self.extrusions = self.infill_extrusions = 0
+        self.start, start = None, self.start
+
+        self.pending.append((start, end, phase))
+        if len(self.pending) > self.final_layers:
+            self.fill(*self.pending.popleft())
+
+    def fill(self, start, end, phase):
+        # Percent p covers the file position p * size / 100, 100 percent the end of the file
+        size = self.size
+        first = -(-start * 100 // size)
+        last = STEPS if end >= size else -(-end * 100 // size)
+        for index in range(first, last):
+            self.phases[index] = phase
+
+    def finish(self):
+        self.close_layer(self.size)
+        while self.pending:
+            start, end, phase = self.pending.popleft()
+            self.fill(start, end, phase if phase == PHASE_FIRST else PHASE_FINAL)
+        return LayerSchedule(self.phases, self.layers)
+
+
+def analyse_gcode(lines, size, final_layers=3, infill_threshold=0.5):
+    # lines is any iterable of bytes lines, e.g. a file opened in binary mode
+    builder = ScheduleBuilder(size, final_layers, infill_threshold)
+    position = 0
+    for line in lines:
+        builder.feed(line, position)
+        position += len(line)
+    return builder.finish()
+
+
+def analyse_file(path, final_layers=3, infill_threshold=0.5):
+    with open(path, 'rb') as f:
+        return analyse_gcode(f, os.path.getsize(path), final_layers, infill_threshold)
+
+
+def file_key(path, file_hash=None, *options):
+    # Cache key of a file analysed with options, OctoPrint's hash of the file when it has one
+    if file_hash is None:
+        stat = os.stat(path)
+        file_hash = hashlib.sha1('{}:{}:{}'.format(path, stat.st_size, stat.st_mtime).encode('utf-8')).hexdigest()
+    return '-'.join([file_hash] + [str(option) for option in options])
+
+
+class ScheduleCache:
+    # Schedules by file key, the most recent in memory and all of them on disk
+    # as STEPS bytes each, so a file is only analysed once.
+
+    def __init__(self, folder=None, maxsize=16):
+        self.folder = folder
+        self.maxsize = maxsize
+        self.__schedules = collections.OrderedDict()
+
+    def __path(self, key):
+        return os.path.join(self.folder, '{}.phases'.format(key))
+
+    def get(self, key):
+        schedule = self.__schedules.get(key)
+        if schedule is not None:
+            self.__schedules.move_to_end(key)
+            return schedule
+
+        if self.folder is None:
+            return None
+        try:
+            with open(self.__path(key), 'rb') as f:
+                phases = f.read()
+        except (IOError, OSError):
+            return None
+        if len(phases) != STEPS:
+            return None
+
+        schedule = LayerSchedule(phases)
+        self.__remember(key, schedule)
+        return schedule
+
+    def put(self, key, schedule):
+        self.__remember(key, schedule)
+        if self.folder is None:
+            return
+
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        with open(self.__path(key), 'wb') as f:
+            f.write(schedule.phases)
+
+    def __remember(self, key, schedule):
+        self.__schedules[key] = schedule
+        self.__schedules.move_to_end(key)
+        while len(self.__schedules) > self.maxsize:
+            self.__schedules.popitem(last=False)
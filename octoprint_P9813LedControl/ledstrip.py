@@ -1,75 +1,108 @@
 # Based on  Philip Leder's ledstrip.py (https://github.com/schlank/Catalex-Led-Strip-Driver-Raspberry-Pi)
-# adapted to gpiozero
+# adapted to gpiozero, output goes through a pluggable backend (see backends.py)
 
+import threading
 import time
-from gpiozero import LED, Device
 
+from octoprint_P9813LedControl.backends import calibrate
+from octoprint_P9813LedControl.encoder import FrameEncoder
 
-class LEDStrip:
-
-    def __init__(self, clock, data):
-        self.__clock = clock
-        self.__data = data
-        self.__delay = 0
-
-        try:
-            self.__clockLed = LED(self.__clock)
-            self.__dataLed = LED(self.__data)
-        except (ImportError, RuntimeError):
-            # Revert to mock pins if not running on raspberry pi
-            from gpiozero.pins.mock import MockFactory
-            Device.pin_factory = MockFactory()
-            self.__clockLed = LED(self.__clock)
-            self.__dataLed = LED(self.__data)
-
-    def __sendclock(self):
-        self.__clockLed.off()
-        time.sleep(self.__delay)
-        self.__clockLed.on()
-        time.sleep(self.__delay)
-
-    def __send32zero(self):
-        for x in range(32):
-            self.__dataLed.off()
-            self.__sendclock()
-
-    def __senddata(self, dx):
-        self.__send32zero()
 
-        for x in range(32):
-            if ((dx & 0x80000000) != 0):
-                self.__dataLed.on()
-            else:
-                self.__dataLed.off()
+def hextorgb(hex):
+    hexcolour = int(hex, 16)
+    red = (hexcolour >> 16) & 0xff
+    green = (hexcolour >> 8) & 0xff
+    blue = hexcolour & 0xff
 
-            dx <<= 1
-            self.__sendclock()
+    return red, green, blue
 
-        self.__send32zero()
 
-    def __getcode(self, dat):
-        tmp = 0
-
-        if ((dat & 0x80) == 0):
-            tmp |= 0x02
-
-        if ((dat & 0x40) == 0):
-            tmp |= 0x01
+class LEDStrip:
 
-        return tmp
+    def __init__(self, backend=None, pixel_count=1, encoder=None, refresh_interval=0, trace=None, metrics=None):
+        # The backend can be attached later, e.g. once opened by the LEDWorker
+        self.backend = backend
+        self.__encoder = encoder if encoder is not None else FrameEncoder()
+
+        # One (r, g, b) triplet per daisy-chained module
+        self.pixel_count = max(1, pixel_count)
+        self.pixels = bytearray(3 * self.pixel_count)
+
+        # Frames identical to the last one sent are dropped, unless the last
+        # send is older than refresh_interval seconds (0 never forces a resend)
+        self.refresh_interval = refresh_interval
+        self.__last_frame = None
+        self.__last_sent = 0
+
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+        # Optional FrameTrace recording every frame sent, tagged with the mode it was sent for
+        self.trace = trace
+        self.mode = ''
+
+        # Optional Metrics receiving the encode and bus write times
+        self.metrics = metrics
+
+    def write(self, frame, force=False):
+        now = time.monotonic()
+        if not force and frame == self.__last_frame and not self.refresh_due(now):
+            self.frames_skipped += 1
+            return False
+
+        if self.metrics is None:
+            self.backend.write(frame)
+        else:
+            started = time.perf_counter()
+            self.backend.write(frame)
+            self.metrics.bus_write.record(time.perf_counter() - started)
+        self.__last_frame = frame
+        self.__last_sent = now
+        self.frames_sent += 1
+
+        if self.trace is not None:
+            self.trace.record(now, self.mode, frame)
+        return True
+
+    def refresh_due(self, now=None):
+        if not self.refresh_interval or self.__last_frame is None:
+            return False
+
+        if now is None:
+            now = time.monotonic()
+        return now - self.__last_sent >= self.refresh_interval
+
+    def refresh(self):
+        # Re-sends the last frame, recovers modules that latched a corrupted frame
+        if self.__last_frame is not None:
+            self.write(self.__last_frame, force=True)
+
+    def calibrate(self, frames=10):
+        # Sends the off frame repeatedly, returns (seconds per frame, achieved bits per second)
+        return calibrate(self.backend, self.__encoder.encode(bytes(len(self.pixels))), frames)
+
+    def show(self):
+        # Sends the whole chain in a single transaction
+        if self.metrics is None:
+            return self.write(self.__encoder.encode(self.pixels))
+
+        started = time.perf_counter()
+        frame = self.__encoder.encode(self.pixels)
+        self.metrics.encode.record(time.perf_counter() - started)
+        return self.write(frame)
+
+    def fill(self, red, green, blue):
+        self.pixels[:] = bytes((red, green, blue)) * self.pixel_count
+
+    def setpixel(self, index, red, green, blue):
+        self.pixels[3 * index:3 * index + 3] = bytes((red, green, blue))
+
+    def setpixels(self, pixels):
+        self.pixels[:] = pixels[:len(self.pixels)]
 
     def setcolourrgb(self, red, green, blue):
-
-        dx = 0
-        dx |= 0x03 << 30
-        dx |= self.__getcode(blue)
-        dx |= self.__getcode(green)
-        dx |= self.__getcode(red)
-        dx |= blue << 16
-        dx |= green << 8
-        dx |= red
-
-        self.__senddata(dx)
+        self.fill(red, green, blue)
+        self.show()
 
     def setcolourwhite(self):
         self.setcolourrgb(255, 255, 255)
@@ -88,18 +121,85 @@ class LEDStrip:
 
     def setcolourhex(self, hex):
         try:
-            hexcolour = int(hex, 16)
-            red = int((hexcolour & 255 * 255 * 255) / (255 * 255))
-            green = int((hexcolour & 255 * 255) / 255)
-            blue = hexcolour & 255
-
-            self.setcolourrgb(red, green, blue)
+            self.setcolourrgb(*hextorgb(hex))
 
         except:
-            hexcolour = 0
             print("Error converting Hex input (%s) a colour." % hex)
 
     def cleanup(self):
+        self.mode = 'off'
         self.setcolouroff()
-        self.__clockLed.close()
-        self.__dataLed.close()
+        self.backend.close()
+
+
+class LEDWorker(threading.Thread):
+    # Owns the LEDStrip and clocks frames out on its own thread, so callers
+    # (OctoPrint's comm thread, timers, API requests) never block on GPIO.
+    # Only the latest posted pixel buffer is kept: a burst of updates that
+    # arrives while a frame is being sent collapses into a single frame.
+    #
+    # The optional opener attaches the strip's backend on the worker thread
+    # before the first frame, so slow hardware probing doesn't hold up the
+    # caller. Colours posted meanwhile wait in the same slot, only the latest
+    # is sent once the backend is ready.
+
+    def __init__(self, strip, opener=None):
+        threading.Thread.__init__(self, name="P9813LedControl output")
+        self.daemon = True
+
+        self.__strip = strip
+        self.__opener = opener
+        self.ready = threading.Event()  # Set once the backend is open
+        self.__pending = None
+        self.__running = True
+        self.__condition = threading.Condition()
+
+    @property
+    def strip(self):
+        return self.__strip
+
+    def run(self):
+        if self.__opener is not None:
+            self.__opener(self.__strip)
+
+        if self.__strip.backend is None:
+            # Opening failed, nothing can be sent
+            return
+        self.ready.set()
+
+        while True:
+            with self.__condition:
+                while self.__pending is None and self.__running:
+                    if not self.__condition.wait(self.__strip.refresh_interval or None):
+                        break
+
+                pixels, mode = self.__pending or (None, None)
+                self.__pending = None
+
+                if pixels is None and not self.__running:
+                    break
+
+            if pixels is None:
+                self.__strip.refresh()
+                continue
+
+            self.__strip.mode = mode
+            self.__strip.setpixels(pixels)
+            self.__strip.show()
+
+        self.__strip.cleanup()
+
+    def post(self, pixels, mode=''):
+        # mode only tags the frame in the strip's trace
+        with self.__condition:
+            self.__pending = (bytes(pixels), mode)
+            self.__condition.notify()
+
+    def stop(self, timeout=5):
+        # Flushes the pending colour, then turns the strip off and releases the pins
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify()
+
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
@@ -0,0 +1,64 @@
+# Parser for Marlin's M150 (set LED colour) gcode:
+#
+#   M150 [R<red>] [U<green>] [B<blue>] [W<white>] [P<brightness>] [I<index>]
+#
+# Colours and brightness range 0-255, missing colours are 0 and a missing
+# brightness is full. I addresses a single module of a chain, without it the
+# whole chain is set. The line is scanned once character by character, no
+# regular expressions involved, so "M150 R255 U0" and "M150R255U0" both work.
+
+M150_PARAMETERS = frozenset('RUBWPI')
+NUMBER_CHARACTERS = frozenset('0123456789.-+')
+
+
+class M150Command:
+    __slots__ = ('red', 'green', 'blue', 'white', 'brightness', 'index')
+
+    def __init__(self, red=0, green=0, blue=0, white=0, brightness=255, index=None):
+        self.red = red
+        self.green = green
+        self.blue = blue
+        self.white = white
+        self.brightness = brightness
+        self.index = index
+
+    def colour(self):
+        # The P9813 has no white channel, white is mixed into all three
+        white = self.white
+        brightness = self.brightness
+        return tuple(min(255, c + white) * brightness // 255 for c in (self.red, self.green, self.blue))
+
+
+def clamp(value):
+    return 0 if value < 0 else 255 if value > 255 else value
+
+
+def parse_m150(cmd):
+    text = cmd.split(';', 1)[0].upper()
+    length = len(text)
+    position = text.find('M150') + 4 if 'M150' in text else 0
+
+    values = {}
+    while position < length:
+        parameter = text[position]
+        position += 1
+        if parameter not in M150_PARAMETERS:
+            continue
+
+        start = position
+        while position < length and text[position] in NUMBER_CHARACTERS:
+            position += 1
+
+        try:
+            values[parameter] = int(float(text[start:position]))
+        except ValueError:
+            pass
+
+    index = values.get('I')
+    return M150Command(
+        red=clamp(values.get('R', 0)),
+        green=clamp(values.get('U', 0)),
+        blue=clamp(values.get('B', 0)),
+        white=clamp(values.get('W', 0)),
+        brightness=clamp(values.get('P', 255)),
+        index=index if index is None or index >= 0 else None)
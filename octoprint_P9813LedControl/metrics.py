@@ -0,0 +1,67 @@
+# Runtime metrics of the hot paths: counters and latency histograms with fixed
+# buckets, cheap enough to stay on in production. Recording is a bisect over
+# the bucket bounds and a few integer increments, no locks are taken: the
+# values are statistics, an increment lost to a race now and then is fine.
+
+import bisect
+
+# Upper bounds of the histogram buckets in microseconds, the last bucket catches everything above
+BUCKETS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, buckets_us=BUCKETS_US):
+        self.bounds = tuple(bound / 1e6 for bound in buckets_us)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self):
+        bounds = [int(round(bound * 1e6)) for bound in self.bounds] + [None]
+        return dict(
+            count=self.count,
+            mean_us=self.total / self.count * 1e6 if self.count else 0.0,
+            max_us=self.max * 1e6,
+            # [upper bound in us (None for the overflow bucket), count], empty buckets left out
+            buckets=[[bound, count] for bound, count in zip(bounds, self.counts) if count]
+        )
+
+
+class Metrics:
+
+    def __init__(self):
+        self.encode = Histogram()  # Encoding a frame, mostly cache hits
+        self.bus_write = Histogram()  # Handing a frame to the output backend
+        self.gcode_hook = Histogram()  # process_gcode_q
+        self.temperatures_hook = Histogram()  # temperatures_received
+        self.effects = 0  # update_effect calls
+
+    def histograms(self):
+        return dict(
+            encode=self.encode,
+            bus_write=self.bus_write,
+            process_gcode_q=self.gcode_hook,
+            temperatures_received=self.temperatures_hook)
+
+    def reset(self):
+        for histogram in self.histograms().values():
+            histogram.reset()
+        self.effects = 0
+
+    def snapshot(self):
+        return dict(
+            histograms=dict((name, histogram.snapshot()) for name, histogram in self.histograms().items()),
+            counters=dict(effects=self.effects))
@@ -0,0 +1,87 @@
+# Renders effects into pixel buffers (one (r, g, b) triplet per chained module)
+# ready for the FrameEncoder. Brightness scaling and gamma correction are folded
+# into a single 256 entry lookup table. The whole chain is computed with one
+# vectorised NumPy operation per frame. NumPy is a requirement of the plugin
+# (see setup.py) and takes a while to import, so it isn't loaded when OctoPrint
+# loads the plugin: the plugin loads it on the output worker once the strip is
+# open, at the latest it is loaded with the first progress frame.
+#
+# The plain Python loop is a last resort for installs where NumPy can't be
+# imported, e.g. a broken wheel, and logs a warning when used.
+
+import logging
+
+numpy = None  # The numpy module once loaded, False when it isn't installed
+
+
+def load_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            logging.getLogger(__name__).warning(
+                "NumPy can't be imported, progress effects are rendered in plain Python")
+            module = False
+        numpy = module
+    return numpy or None
+
+
+def gammatable(brightness=100, gamma=1.0):
+    scale = max(0, min(100, brightness)) / 100.0
+    return bytes(int(round(255 * ((i / 255.0) ** gamma) * scale)) for i in range(256))
+
+
+class PixelRenderer:
+
+    def __init__(self, pixel_count=1, brightness=100, gamma=1.0):
+        self.pixel_count = max(1, pixel_count)
+        self.brightness = brightness
+        self.gamma = gamma
+        self.__table = gammatable(brightness, gamma)
+
+        self.__numpy = None  # Loaded with the first progress frame
+        self.__lut = None
+        self.__positions = None
+
+    def __load_numpy(self):
+        numpy = load_numpy()
+        if numpy is not None:
+            self.__lut = numpy.frombuffer(self.__table, dtype=numpy.uint8)
+            self.__positions = numpy.arange(self.pixel_count, dtype=numpy.float32)
+        self.__numpy = numpy if numpy is not None else False
+
+    def apply(self, pixels):
+        # Brightness and gamma for a pixel buffer set directly, e.g. by M150
+        return bytes(pixels).translate(self.__table)
+
+    def fill(self, colour):
+        table = self.__table
+        return bytes((table[colour[0]], table[colour[1]], table[colour[2]])) * self.pixel_count
+
+    def progress(self, base, colour, progress):
+        # Gradient from the base colour to the progress colour across the chain,
+        # the pixel at the progress boundary is blended proportionally.
+        lit = max(0.0, min(100.0, progress)) / 100.0 * self.pixel_count
+
+        if self.__numpy is None:
+            self.__load_numpy()
+
+        numpy = self.__numpy
+        if numpy is False:
+            return self.__progress_python(base, colour, lit)
+
+        fraction = numpy.clip(lit - self.__positions, 0.0, 1.0)[:, numpy.newaxis]
+        base = numpy.array(base, dtype=numpy.float32)
+        rgb = base + (numpy.array(colour, dtype=numpy.float32) - base) * fraction
+        return self.__lut[(rgb + 0.5).astype(numpy.uint8)].tobytes()
+
+    def __progress_python(self, base, colour, lit):
+        # Fallback without NumPy, one Python iteration per pixel
+        table = self.__table
+        pixels = bytearray(3 * self.pixel_count)
+        for i in range(self.pixel_count):
+            fraction = max(0.0, min(1.0, lit - i))
+            for c in range(3):
+                pixels[3 * i + c] = table[int(base[c] + (colour[c] - base[c]) * fraction + 0.5)]
+        return bytes(pixels)
@@ -0,0 +1,148 @@
+# One long-lived thread running every delayed transition of the plugin: auto
+# off, returning to idle after a successful print, torch expiry and animation
+# frames. Deadlines are kept in a heap, cancelling a call only flags it so
+# re-arming a timer on every progress tick costs no thread creation.
+#
+# The clock is pluggable. With a FakeClock the thread isn't started, tests
+# advance the clock and call run_pending() to run whatever became due.
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class MonotonicClock:
+
+    def time(self):
+        return time.monotonic()
+
+
+class FakeClock:
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ScheduledCall:
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(threading.Thread):
+
+    def __init__(self, clock=None, logger=None):
+        threading.Thread.__init__(self, name="P9813LedControl scheduler")
+        self.daemon = True
+
+        self.clock = clock if clock is not None else MonotonicClock()
+        self.__logger = logger if logger is not None else logging.getLogger(__name__)
+        self.__queue = []
+        self.__sequence = itertools.count()
+        self.__compact_at = 64
+        self.__running = True
+        self.__condition = threading.Condition()
+
+        self.calls_scheduled = 0
+        self.calls_run = 0
+        self.calls_cancelled = 0  # Cancelled calls dropped from the queue
+
+    def call_at(self, deadline, callback, *args):
+        call = ScheduledCall(deadline, callback, args)
+        with self.__condition:
+            wake = not self.__queue or deadline < self.__queue[0][0]
+            heapq.heappush(self.__queue, (deadline, next(self.__sequence), call))
+            self.calls_scheduled += 1
+
+            if len(self.__queue) > self.__compact_at:
+                # Far-off cancelled calls would otherwise pile up until their deadline
+                queued = len(self.__queue)
+                self.__queue = [entry for entry in self.__queue if not entry[2].cancelled]
+                heapq.heapify(self.__queue)
+                self.calls_cancelled += queued - len(self.__queue)
+                self.__compact_at = max(64, 2 * len(self.__queue))
+
+            if wake:
+                self.__condition.notify()
+        return call
+
+    def call_soon(self, callback, *args):
+        # Runs ahead of any due timer, calls made with call_soon run in the order they were made
+        return self.call_at(float('-inf'), callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.clock.time() + delay, callback, *args)
+
+    def pending(self):
+        with self.__condition:
+            return sum(1 for entry in self.__queue if not entry[2].cancelled)
+
+    def __pop_due(self, now):
+        # Returns the next due call, dropping cancelled ones on the way
+        with self.__condition:
+            while self.__queue:
+                deadline, _, call = self.__queue[0]
+                if call.cancelled:
+                    heapq.heappop(self.__queue)
+                    self.calls_cancelled += 1
+                    continue
+                if deadline > now:
+                    return None
+                heapq.heappop(self.__queue)
+                return call
+        return None
+
+    def run_pending(self):
+        while True:
+            call = self.__pop_due(self.clock.time())
+            if call is None:
+                return
+
+            self.calls_run += 1
+            try:
+                call.callback(*call.args)
+            except Exception:
+                self.__logger.exception("Error running scheduled {}".format(call.callback))
+
+    def run(self):
+        while True:
+            self.run_pending()
+
+            with self.__condition:
+                if not self.__running:
+                    return
+
+                while self.__queue and self.__queue[0][2].cancelled:
+                    heapq.heappop(self.__queue)
+                    self.calls_cancelled += 1
+
+                if self.__queue:
+                    timeout = self.__queue[0][0] - self.clock.time()
+                    if timeout > 0:
+                        self.__condition.wait(timeout)
+                else:
+                    self.__condition.wait()
+
+    def stop(self, timeout=5):
+        with self.__condition:
+            self.__running = False
+            self.__queue = []
+            self.__condition.notify()
+
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
@@ -0,0 +1,57 @@
+# Single-writer state. Every change to the plugin's state (effects, lights,
+# torch, reconfiguration) is queued as an immutable Command and executed in
+# order on the scheduler thread, the only thread writing the state. OctoPrint's
+# comm thread, Flask request threads and event handlers only submit commands.
+#
+# After each command the writer publishes an immutable PluginState. Readers,
+# e.g. on_api_get, take the current snapshot with a single attribute read: no
+# lock, and never a mix of two states.
+
+import threading
+
+
+class Command:
+    __slots__ = ('action', 'args', 'done')
+
+    def __init__(self, action, args=(), wait=False):
+        set = object.__setattr__
+        set(self, 'action', action)
+        set(self, 'args', tuple(args))
+        set(self, 'done', threading.Event() if wait else None)  # Only for submitters waiting on the result
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Command is immutable")
+
+    __delattr__ = __setattr__
+
+    def run(self):
+        try:
+            self.action(*self.args)
+        finally:
+            if self.done is not None:
+                self.done.set()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout) if self.done is not None else True
+
+
+class PluginState:
+    __slots__ = ('lights_on', 'torch_on', 'effect')
+
+    def __init__(self, lights_on=False, torch_on=False, effect='off'):
+        set = object.__setattr__
+        set(self, 'lights_on', lights_on)
+        set(self, 'torch_on', torch_on)
+        set(self, 'effect', effect)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PluginState is immutable, publish a new one instead")
+
+    __delattr__ = __setattr__
+
+    def status(self):
+        return dict(
+            lights_status=self.lights_on or self.torch_on,
+            torch_status=self.torch_on,
+            effect=self.effect
+        )
@@ -10,8 +10,8 @@ $(function () {
         var switch_icon = $("#toggleSwitch");
         var torch_icon = $("#torchIcon");
 
-        setInterval(updateButtonStates, 5000);
-
+        // State changes are pushed by the plugin, the status is only fetched
+        // once on startup and after reconnecting to the server.
         function updateButtonStates() {
             OctoPrint.simpleApiCommand("P9813LedControl", "get_status").done(
                 update_light_status
@@ -21,7 +21,9 @@ $(function () {
         function update_light_status(response) {
             if (response.lights_status) {
                 light_icon.addClass("text-warning");
-                switch_icon.addClass("fa-toggle-on text-warning");
+                switch_icon
+                    .removeClass("fa-toggle-off")
+                    .addClass("fa-toggle-on text-warning");
             } else {
                 light_icon.removeClass("text-warning");
                 switch_icon
@@ -42,15 +44,17 @@ $(function () {
         };
 
         self.activate_torch = function () {
-            var torch_time = self.settingsViewModel.settings.plugins.P9813LedControl.torch_timer();
             OctoPrint.simpleApiCommand(
                 "P9813LedControl",
                 "activate_torch"
             ).done(update_light_status);
-            setTimeout(
-                self.updateButtonStates,
-                parseInt(torch_time, 10) * 1000
-            );
+        };
+
+        self.onDataUpdaterPluginMessage = function (plugin, data) {
+            if (plugin !== "P9813LedControl") {
+                return;
+            }
+            update_light_status(data);
         };
 
         self.onBeforeBinding = function () {
@@ -60,9 +64,11 @@ $(function () {
         };
 
         self.onStartupComplete = function () {
-            self.printerStateModel.onEventPrinterStateChanged = function () {
-                updateButtonStates();
-            };
+            updateButtonStates();
+        };
+
+        self.onServerReconnect = function () {
+            updateButtonStates();
         };
     }
 
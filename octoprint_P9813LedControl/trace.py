@@ -0,0 +1,100 @@
+# Always-on trace of the frames sent to the strip, to tell whether a wrong
+# colour was chosen by the plugin or garbled on the bus. Every frame written
+# is recorded with its monotonic timestamp and the effect it was sent for into
+# a fixed-size ring buffer, recording is a single struct pack and a slice copy.
+#
+# The buffer can be backed by an mmap'd file, which survives a crash and can
+# be copied off the printer and replayed (see benchmarks/replay_trace.py). A
+# trace left by an earlier run, e.g. the one that crashed, is kept next to it
+# with ROTATED_SUFFIX appended.
+#
+# Layout: header, then capacity fixed-size records of
+#   timestamp, mode (ASCII, truncated), frame length, frame (padded)
+
+import mmap
+import os
+import struct
+
+MAGIC = b'P9T1'
+HEADER = struct.Struct('<4sIIQ')  # magic, record size, capacity, records written
+RECORD = struct.Struct('<d16sH')  # timestamp, mode, frame length
+ROTATED_SUFFIX = '.1'
+
+
+class FrameTrace:
+
+    def __init__(self, capacity=1024, frame_size=16, path=None):
+        self.capacity = max(1, capacity)
+        self.frame_size = frame_size  # Longer frames are truncated
+        self.record_size = RECORD.size + frame_size
+        self.path = path
+
+        size = HEADER.size + self.capacity * self.record_size
+        if path is None:
+            self.__file = None
+            self.__buffer = bytearray(size)
+        else:
+            rotate_trace(path)
+            self.__file = open(path, 'w+b')
+            self.__file.truncate(size)
+            self.__buffer = mmap.mmap(self.__file.fileno(), size)
+
+        self.count = 0
+        HEADER.pack_into(self.__buffer, 0, MAGIC, self.record_size, self.capacity, 0)
+
+    def record(self, timestamp, mode, frame):
+        offset = HEADER.size + (self.count % self.capacity) * self.record_size
+        length = min(len(frame), self.frame_size)
+        RECORD.pack_into(self.__buffer, offset, timestamp, mode.encode('ascii', 'replace'), length)
+        offset += RECORD.size
+        self.__buffer[offset:offset + length] = frame[:length]
+
+        self.count += 1
+        HEADER.pack_into(self.__buffer, 0, MAGIC, self.record_size, self.capacity, self.count)
+
+    def records(self):
+        # (timestamp, mode, frame) of the recorded frames, oldest first
+        return read_records(self.__buffer)
+
+    def flush(self):
+        if self.__file is not None:
+            self.__buffer.flush()
+
+    def close(self):
+        if self.__file is None:
+            return
+
+        self.__buffer.flush()
+        self.__buffer.close()
+        self.__file.close()
+        self.__file = None
+
+
+def read_records(buffer):
+    magic, record_size, capacity, count = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a frame trace")
+
+    first = max(0, count - capacity)
+    for index in range(first, count):
+        offset = HEADER.size + (index % capacity) * record_size
+        timestamp, mode, length = RECORD.unpack_from(buffer, offset)
+        offset += RECORD.size
+        yield timestamp, mode.rstrip(b'\0').decode('ascii'), bytes(buffer[offset:offset + length])
+
+
+def rotate_trace(path):
+    # Moves an existing trace out of the way, replacing the one rotated before
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        os.replace(path, path + ROTATED_SUFFIX)
+
+
+def load_trace(path):
+    # Records of a trace file, e.g. one copied off the printer
+    with open(path, 'rb') as file:
+        return list(read_records(file.read()))
+
+
+def trace_frame_size(pixel_count):
+    # Start frame, one word per module and end frame
+    return 8 + 4 * max(1, pixel_count)
@@ -0,0 +1,104 @@
+import functools
+import os
+
+import pytest
+
+from octoprint_P9813LedControl.backends import GPCLR0, GPFSEL0, GPSET0, FakeSpiDev, GpioMemBackend, SPIBackend, \
+    create_delay, create_gpiomem_standin
+from octoprint_P9813LedControl.encoder import FrameEncoder
+
+CLOCK = 13
+DATA = 12
+
+
+def test_spi_fallback_doesnt_record_frames():
+    backend = SPIBackend()
+    backend.write(bytes(8))
+    assert backend.device.transfers == []
+
+
+def test_spi_sends_each_frame_in_one_transfer():
+    backend = SPIBackend(1, 2, speed_hz=1e6, spi_factory=functools.partial(FakeSpiDev, record=True))
+    frame = FrameEncoder().encode(bytes((255, 0, 0, 0, 0, 255)))
+    backend.write(frame)
+    backend.write(frame)
+
+    device = backend.device
+    assert (device.bus, device.device, device.mode, device.max_speed_hz) == (1, 2, 0, 1000000)
+    assert device.transfers == [frame, frame]
+
+    backend.close()
+    assert device.closed
+    with pytest.raises(IOError):
+        device.xfer([0])
+
+
+class RecordingRegisters:
+    # Register writes of the backend, in order
+    def __init__(self, registers):
+        self.registers = registers
+        self.writes = []
+
+    def __getitem__(self, index):
+        return self.registers[index]
+
+    def __setitem__(self, index, value):
+        self.writes.append((index, value))
+        self.registers[index] = value
+
+
+@pytest.fixture
+def standin(tmp_path):
+    return create_gpiomem_standin(str(tmp_path / 'gpiomem'))
+
+
+def test_gpiomem_sets_pin_functions(standin):
+    backend = GpioMemBackend(CLOCK, DATA, path=standin)
+    registers = backend.registers
+
+    # Pins 12 and 13 are outputs, function 1 in GPFSEL1
+    assert (registers[GPFSEL0 + 1] >> 6) & 7 == 1
+    assert (registers[GPFSEL0 + 1] >> 9) & 7 == 1
+
+    backend.close()
+    with open(standin, 'rb') as f:
+        fsel1 = int.from_bytes(f.read()[4:8], 'little')
+    assert fsel1 & (0x3f << 6) == 0
+    assert os.path.exists(standin)  # Only scratch files of its own are removed
+
+
+def test_gpiomem_clocks_out_frame_msb_first(standin):
+    backend = GpioMemBackend(CLOCK, DATA, path=standin)
+    registers = backend.registers
+    recorder = RecordingRegisters(registers)
+    backend._GpioMemBackend__registers = recorder
+    try:
+        backend.write(bytes((0xa5,)))
+    finally:
+        backend._GpioMemBackend__registers = registers
+        backend.close()
+
+    # Per bit: data set or cleared, clock low, clock high
+    bits = []
+    for i in range(0, len(recorder.writes), 3):
+        data, low, high = recorder.writes[i:i + 3]
+        assert data[1] == 1 << DATA
+        assert low == (GPCLR0, 1 << CLOCK) and high == (GPSET0, 1 << CLOCK)
+        bits.append(1 if data[0] == GPSET0 else 0)
+    assert bits == [1, 0, 1, 0, 0, 1, 0, 1]
+
+
+def test_gpiomem_warns_when_using_a_scratch_file(tmp_path, caplog):
+    backend = GpioMemBackend(CLOCK, DATA, path=str(tmp_path / 'missing'))
+    scratch = backend.path
+    assert os.path.exists(scratch)
+    assert 'missing does not exist' in caplog.text
+
+    backend.close()
+    assert not os.path.exists(scratch)
+
+
+def test_create_delay():
+    assert create_delay(0) is None
+    assert create_delay(None) is None
+    assert create_delay(1000000) is not None
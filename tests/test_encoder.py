@@ -0,0 +1,83 @@
+# The encoder has to put exactly the bits on the wire that the original
+# bit-by-bit driver clocked out: 32 zero bits, the colour word MSB first with
+# the checksum from __getcode, 32 zero bits.
+
+import itertools
+
+from octoprint_P9813LedControl.encoder import FrameEncoder, decodeframe, decodeword, encodeword
+
+LEVELS = (0x00, 0x01, 0x3f, 0x40, 0x7f, 0x80, 0xbf, 0xc0, 0xfe, 0xff)
+
+
+def baseline_getcode(dat):
+    tmp = 0
+
+    if ((dat & 0x80) == 0):
+        tmp |= 0x02
+
+    if ((dat & 0x40) == 0):
+        tmp |= 0x01
+
+    return tmp
+
+
+def baseline_word(red, green, blue):
+    dx = 0
+    dx |= 0x03 << 30
+    dx |= baseline_getcode(blue)
+    dx |= baseline_getcode(green)
+    dx |= baseline_getcode(red)
+    dx |= blue << 16
+    dx |= green << 8
+    dx |= red
+
+    return dx
+
+
+def baseline_bits(red, green, blue):
+    # Data line level at every clock edge of the original __senddata
+    bits = [0] * 32
+    dx = baseline_word(red, green, blue)
+    for x in range(32):
+        bits.append(1 if (dx & 0x80000000) != 0 else 0)
+        dx <<= 1
+    return bits + [0] * 32
+
+
+def frame_bits(frame):
+    return [(byte >> (7 - bit)) & 1 for byte in frame for bit in range(8)]
+
+
+def test_encodeword_matches_baseline():
+    for red, green, blue in itertools.product(range(0, 256, 5), LEVELS, LEVELS):
+        assert encodeword(red, green, blue) == baseline_word(red, green, blue)
+
+
+def test_single_module_frame_matches_baseline_bits():
+    encoder = FrameEncoder()
+    for red, green, blue in itertools.product(LEVELS, repeat=3):
+        frame = encoder.encode(bytes((red, green, blue)))
+        assert frame_bits(frame) == baseline_bits(red, green, blue)
+
+
+def test_chain_frame_holds_one_word_per_module():
+    # Red values with both low bits set, like in the original driver the checksum is ORed into the red byte
+    pixels = bytes((255, 0, 0, 3, 128, 64, 7, 2, 3))
+    frame = FrameEncoder().encode(pixels)
+
+    assert len(frame) == 8 + 4 * 3
+    assert frame[:4] == bytes(4) and frame[-4:] == bytes(4)
+    assert decodeframe(frame) == [(255, 0, 0, True), (3, 128, 64, True), (7, 2, 3, True)]
+
+
+def test_encode_reuses_cached_frames():
+    encoder = FrameEncoder(maxsize=4)
+    first = encoder.encode(bytearray((10, 20, 30)))
+    assert encoder.encode(bytes((10, 20, 30))) is first
+    assert encoder.cache_info().hits == 1
+
+
+def test_decodeword_flags_corrupted_checksum():
+    word = encodeword(203, 100, 50)
+    assert decodeword(word) == (203, 100, 50, True)
+    assert not decodeword(word ^ (1 << 29))[3]
@@ -0,0 +1,47 @@
+from octoprint_P9813LedControl.heatup import HeatupTracker
+
+
+def ramp(tracker, start, end, target, heater='T0'):
+    # Displayed values of a heater heating one degree per report
+    shown = []
+    for temperature in range(start, end + 1):
+        progress = tracker.update({heater: (float(temperature), target)})
+        if progress is not None:
+            shown.append(progress)
+    return shown
+
+
+def test_ramp_reaches_100_percent():
+    shown = ramp(HeatupTracker(steps=20, hysteresis=1.0), 20, 215, 210.0)
+    assert shown[-1] == 100.0
+    assert shown == sorted(shown)
+
+
+def test_ramp_without_hysteresis_shows_every_step():
+    shown = ramp(HeatupTracker(steps=10, hysteresis=0.0), 0, 100, 100.0)
+    assert shown == [10.0 * step for step in range(11)]
+
+
+def test_hysteresis_holds_step_at_boundary():
+    tracker = HeatupTracker(steps=10, hysteresis=1.0)
+    assert tracker.update({'T0': (50.5, 100.0)}) == 50.0
+
+    # Hovering around 60% stays on 50% until clearly past the boundary
+    assert tracker.update({'T0': (60.5, 100.0)}) is None
+    assert tracker.update({'T0': (61.5, 100.0)}) == 60.0
+    assert tracker.update({'T0': (59.5, 100.0)}) is None
+    assert tracker.update({'T0': (58.5, 100.0)}) == 50.0
+
+
+def test_slowest_heater_is_shown():
+    tracker = HeatupTracker(steps=20, hysteresis=0.0)
+    assert tracker.update({'T0': (200.0, 200.0), 'B': (30.0, 60.0)}) == 50.0
+
+    # Targets are remembered when later reports leave them out
+    assert tracker.update({'T0': (200.0, None), 'B': (60.0, None)}) == 100.0
+
+
+def test_untracked_and_switched_off_heaters_are_ignored():
+    tracker = HeatupTracker(steps=20, hysteresis=0.0, bed=False)
+    assert tracker.update({'T0': (100.0, 200.0), 'B': (20.0, 60.0)}) == 50.0
+    assert tracker.update({'T0': (100.0, 0.0)}) is None
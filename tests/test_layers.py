@@ -0,0 +1,64 @@
+import threading
+
+import stubs
+
+import octoprint_P9813LedControl
+from octoprint_P9813LedControl.layers import PHASE_FINAL, PHASE_FIRST, PHASE_INFILL, PHASE_NONE, LayerSchedule, \
+    analyse_gcode
+
+GCODE = b''.join([
+    b';LAYER:0\n', b'G1 X1 E1\n',
+    b';LAYER:1\n', b';TYPE:FILL\n', b'G1 X1 E1\n', b'G1 X2 E2\n',
+    b';LAYER:2\n', b';TYPE:WALL-OUTER\n', b'G1 X1 E1\n',
+    b';LAYER:3\n', b'G1 X1 E1\n',
+])
+
+
+class StubFileManager:
+
+    def path_on_disk(self, origin, path):
+        return '/gcode/' + path
+
+    def get_metadata(self, origin, path):
+        return dict(hash='hash-of-' + path)
+
+
+def test_layers_are_assigned_phases():
+    schedule = analyse_gcode(GCODE.splitlines(True), len(GCODE), final_layers=1)
+    assert schedule.layers == 4
+    assert schedule.phase_at(0) == PHASE_FIRST
+    assert {schedule.phase_at(progress) for progress in range(101)} == {
+        PHASE_FIRST, PHASE_INFILL, PHASE_NONE, PHASE_FINAL}
+    assert schedule.phase_at(100) == PHASE_FINAL
+
+
+def test_reselecting_a_file_analyses_it_once(monkeypatch):
+    release = threading.Event()
+    analysed = []
+
+    def analyse_file(path, final_layers, infill_threshold):
+        analysed.append(path)
+        release.wait(5)
+        return LayerSchedule(bytes([PHASE_INFILL]) * 101, 10)
+
+    monkeypatch.setattr(octoprint_P9813LedControl, 'analyse_file', analyse_file)
+    plugin = stubs.create_plugin(dict(led_backend='spi', bus_calibrate=False, layer_schedule_enabled=True))
+    plugin._file_manager = StubFileManager()
+
+    for _ in range(3):
+        plugin.on_event('FileSelected', dict(origin='local', path='big.gcode'))
+    release.set()
+    for _ in range(100):
+        plugin.submit(lambda: None, wait=True)
+        if plugin.layer_schedule is not None:
+            break
+
+    assert analysed == ['/gcode/big.gcode']
+    assert plugin.layer_schedule.phase_at(50) == PHASE_INFILL
+
+    # The phase mode comes back once the torch expires
+    plugin.on_print_progress('local', 'big.gcode', 50)
+    plugin.activate_torch()
+    plugin.submit(plugin.deactivate_torch, wait=True)
+    assert plugin.get_status()['effect'] == 'layer_infill'
+    plugin.on_shutdown()
@@ -0,0 +1,25 @@
+from octoprint_P9813LedControl.renderer import PixelRenderer
+
+
+def test_progress_blends_the_boundary_pixel():
+    renderer = PixelRenderer(4)
+    assert renderer.progress((0, 0, 0), (0, 200, 0), 0) == bytes(12)
+    assert renderer.progress((0, 0, 0), (0, 200, 0), 37.5) == bytes((0, 200, 0, 0, 100, 0)) + bytes(6)
+    assert renderer.progress((0, 0, 0), (0, 200, 0), 100) == bytes((0, 200, 0)) * 4
+
+
+def test_numpy_matches_the_python_fallback():
+    # NumPy computes in float32, values on a rounding boundary may differ by one
+    for pixel_count in (1, 7, 30):
+        renderer = PixelRenderer(pixel_count, brightness=80, gamma=2.2)
+        for progress in range(0, 1001, 7):
+            lit = progress / 1000.0 * pixel_count
+            vectorised = renderer.progress((10, 20, 30), (250, 128, 0), progress / 10.0)
+            fallback = renderer._PixelRenderer__progress_python((10, 20, 30), (250, 128, 0), lit)
+            assert max(abs(a - b) for a, b in zip(vectorised, fallback)) <= 1
+
+
+def test_brightness_and_gamma_lookup():
+    renderer = PixelRenderer(2, brightness=50)
+    assert renderer.fill((255, 0, 128)) == bytes((128, 0, 64)) * 2
+    assert renderer.apply(bytes((255, 255, 255))) == bytes((128, 128, 128))
@@ -0,0 +1,71 @@
+from octoprint_P9813LedControl.scheduler import FakeClock, Scheduler
+
+
+def create_scheduler():
+    # Not started, calls only run through run_pending
+    return Scheduler(clock=FakeClock(100.0))
+
+
+def test_calls_run_once_due_in_deadline_order():
+    scheduler = create_scheduler()
+    calls = []
+    scheduler.call_later(2, calls.append, 'b')
+    scheduler.call_later(1, calls.append, 'a')
+
+    scheduler.run_pending()
+    assert calls == []
+
+    scheduler.clock.advance(1)
+    scheduler.run_pending()
+    assert calls == ['a']
+
+    scheduler.clock.advance(5)
+    scheduler.run_pending()
+    assert calls == ['a', 'b']
+    assert scheduler.calls_run == 2
+
+
+def test_call_soon_runs_first_in_submission_order():
+    scheduler = create_scheduler()
+    calls = []
+    scheduler.call_at(0, calls.append, 'due')
+    for name in ('first', 'second', 'third'):
+        scheduler.call_soon(calls.append, name)
+
+    scheduler.run_pending()
+    assert calls == ['first', 'second', 'third', 'due']
+
+
+def test_cancelled_calls_are_dropped():
+    scheduler = create_scheduler()
+    calls = []
+    scheduler.call_later(1, calls.append, 'cancelled').cancel()
+    scheduler.call_later(1, calls.append, 'kept')
+    assert scheduler.pending() == 1
+
+    scheduler.clock.advance(1)
+    scheduler.run_pending()
+    assert calls == ['kept']
+    assert scheduler.calls_cancelled == 1
+
+
+def test_rearming_a_timer_doesnt_pile_up_cancelled_calls():
+    scheduler = create_scheduler()
+    timer = None
+    for _ in range(1000):
+        if timer is not None:
+            timer.cancel()
+        timer = scheduler.call_later(600, lambda: None)
+
+    assert scheduler.pending() == 1
+    assert scheduler.calls_cancelled >= 900
+
+
+def test_failing_call_doesnt_stop_the_others():
+    scheduler = create_scheduler()
+    calls = []
+    scheduler.call_soon(lambda: 1 / 0)
+    scheduler.call_soon(calls.append, 'after')
+
+    scheduler.run_pending()
+    assert calls == ['after']
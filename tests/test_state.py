@@ -0,0 +1,150 @@
+# Drives the plugin from many threads at once, the way OctoPrint's comm
+# thread, Flask request threads and event handlers do during a print, with the
+# strip on the bit-banged backend. The clock and data pins log every change,
+# the frames are rebuilt from the data line at each rising clock edge: edges of
+# two frames interleaving on the bus show up as torn frames.
+
+import base64
+import functools
+import random
+import sys
+import threading
+import time
+
+import pytest
+from gpiozero.pins.mock import MockFactory, MockPin
+
+import stubs
+
+import octoprint_P9813LedControl
+from octoprint_P9813LedControl.backends import create_backend
+from octoprint_P9813LedControl.frames import parse_frame_request
+
+PIXEL_COUNT = 2
+CLOCK = 13
+DATA = 12
+SECONDS = 1.0
+THREADS = 2
+MODES = ['idle', 'paused', 'failed', 'printing', 'success', 'torch', 'on', 'off', 'disconnected']
+
+
+class EdgePin(MockPin):
+    # Logs every change of every pin of its factory, in order
+    def _change_state(self, value):
+        changed = MockPin._change_state(self, value)
+        if changed:
+            self.factory.edges.append((self.info.name, value))
+        return changed
+
+
+def bus_frames(edges, frame_size):
+    # Bytes clocked out on the rising clock edges, split into frames
+    clock = data = False
+    bits = []
+    for name, value in edges:
+        if name == 'GPIO{}'.format(DATA):
+            data = value
+        elif name == 'GPIO{}'.format(CLOCK):
+            if value and not clock:
+                bits.append(1 if data else 0)
+            clock = value
+
+    sent = bytes(
+        int(''.join(str(bit) for bit in bits[i:i + 8]), 2) for i in range(0, len(bits) - len(bits) % 8, 8))
+    return [sent[i:i + frame_size] for i in range(0, len(sent), frame_size)], len(bits) % (8 * frame_size)
+
+
+def effects(plugin, rng):
+    mode = rng.choice(MODES + ['progress_print', 'progress_heatup'])
+    plugin.update_effect(mode, rng.uniform(0, 100) if mode.startswith('progress') else None)
+
+
+def gcode(plugin, rng):
+    roll = rng.random()
+    if roll < 0.3:
+        line = 'M150 R{} U{} B{} I{}'.format(
+            rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.randrange(PIXEL_COUNT))
+        plugin.process_gcode_q(None, 'queuing', line, None, 'M150')
+    elif roll < 0.35:
+        plugin.process_gcode_q(None, 'queuing', 'M109 S210', None, 'M109')
+    else:
+        plugin.process_gcode_q(None, 'queuing', 'G1 X10 Y10', None, 'G1')
+
+
+def temperatures(plugin, rng):
+    plugin.temperatures_received(None, {'T0': (rng.uniform(20, 210), 210.0), 'B': (rng.uniform(20, 60), 60.0)})
+
+
+def api(plugin, rng):
+    roll = rng.random()
+    if roll < 0.4:
+        plugin.toggle_lights()
+    elif roll < 0.6:
+        plugin.activate_torch()
+    else:
+        frames = [base64.b64encode(bytes(rng.randrange(256) for _ in range(3 * PIXEL_COUNT))).decode()
+                  for _ in range(rng.randrange(1, 5))]
+        plugin.submit(plugin.set_effect, 'frame', parse_frame_request(dict(frames=frames), PIXEL_COUNT))
+
+
+def progress(plugin, rng):
+    plugin.on_print_progress('local', 'stress.gcode', rng.randrange(100))
+
+
+WRITERS = [effects, gcode, temperatures, api, progress]
+
+
+@pytest.fixture
+def pins(monkeypatch):
+    factory = MockFactory(pin_class=EdgePin)
+    factory.edges = []
+    monkeypatch.setattr(octoprint_P9813LedControl, 'create_backend',
+                        functools.partial(create_backend, pin_factory=factory))
+
+    # Switch threads far more often than the default 5 ms, to interleave them as much as possible
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield factory
+    sys.setswitchinterval(interval)
+    factory.close()
+
+
+def test_concurrent_inputs_only_send_whole_frames(pins):
+    plugin = stubs.create_plugin(dict(
+        led_backend='bitbang', ledgpio_clk=CLOCK, ledgpio_data=DATA, pixel_count=PIXEL_COUNT,
+        intercept_m150=True, bus_calibrate=False, m150_interval=5, trace_frames=100000), mock_pins=False)
+    assert plugin.led.ready.wait(5)
+
+    errors = []
+    stop = time.monotonic() + SECONDS
+
+    def writer(work, seed):
+        rng = random.Random(seed)
+        while time.monotonic() < stop:
+            work(plugin, rng)
+
+    def reader():
+        while time.monotonic() < stop:
+            status = plugin.get_status()
+            if status['torch_status'] and not status['lights_status']:
+                errors.append("Torch on with the lights off: {}".format(status))
+            time.sleep(0)
+
+    workers = [threading.Thread(target=writer, args=(work, 100 * i + n))
+               for i in range(THREADS) for n, work in enumerate(WRITERS)]
+    workers += [threading.Thread(target=reader) for _ in range(THREADS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    trace = plugin.trace
+    plugin.on_shutdown()
+
+    # Every frame on the wire is a whole frame the strip meant to send, in the order it sent them
+    sent = [frame for _, _, frame in trace.records()]
+    frames, leftover = bus_frames(pins.edges, 8 + 4 * PIXEL_COUNT)
+    assert not errors
+    assert leftover == 0
+    assert len(sent) == trace.count > 10
+    assert frames == sent
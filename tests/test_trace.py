@@ -0,0 +1,39 @@
+import os
+
+from octoprint_P9813LedControl.trace import ROTATED_SUFFIX, FrameTrace, load_trace
+
+
+def test_ring_keeps_the_last_frames():
+    trace = FrameTrace(capacity=3, frame_size=4)
+    for index in range(5):
+        trace.record(float(index), 'mode{}'.format(index), bytes((index,)) * 6)
+
+    assert list(trace.records()) == [
+        (2.0, 'mode2', bytes((2,)) * 4), (3.0, 'mode3', bytes((3,)) * 4), (4.0, 'mode4', bytes((4,)) * 4)]
+
+
+def test_trace_of_the_previous_run_is_kept(tmp_path):
+    path = str(tmp_path / 'frames.trace')
+
+    crashed = FrameTrace(capacity=4, frame_size=4, path=path)
+    crashed.record(1.0, 'failed', b'\x00\x01\x02\x03')
+    crashed.flush()  # Never closed, as after a crash
+
+    restarted = FrameTrace(capacity=4, frame_size=4, path=path)
+    restarted.record(2.0, 'idle', b'\x04\x05\x06\x07')
+    restarted.close()
+
+    assert load_trace(path + ROTATED_SUFFIX) == [(1.0, 'failed', b'\x00\x01\x02\x03')]
+    assert load_trace(path) == [(2.0, 'idle', b'\x04\x05\x06\x07')]
+    crashed.close()
+
+
+def test_rotation_replaces_the_older_trace(tmp_path):
+    path = str(tmp_path / 'frames.trace')
+    for run in range(3):
+        trace = FrameTrace(capacity=2, frame_size=4, path=path)
+        trace.record(float(run), 'run', bytes(4))
+        trace.close()
+
+    assert [timestamp for timestamp, _, _ in load_trace(path + ROTATED_SUFFIX)] == [1.0]
+    assert sorted(os.listdir(str(tmp_path))) == ['frames.trace', 'frames.trace' + ROTATED_SUFFIX]